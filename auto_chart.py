@@ -0,0 +1,189 @@
+import io
+import math
+import re
+
+import numpy as np
+import pandas as pd
+
+from query_control import QueryCancelled
+from result_profile import coerce_types, fetch_result
+
+
+# Graphique automatique du résultat d'une requête. Le type est choisi selon la forme
+# du résultat (date + nombres -> courbe, catégorie + nombres -> barres, deux nombres
+# -> nuage de points) et le nombre de points envoyés au navigateur est borné :
+# les séries temporelles tronquées sont agrégées par intervalles directement en SQL,
+# les autres sont réduites localement (LTTB, échantillonnage ou top des catégories).
+
+DEFAULT_CHART_MAX_POINTS = 1000
+DEFAULT_CHART_MAX_BARS = 50
+MAX_SERIES = 5
+
+# id, ID, customer_id, ArtistId, ArtistID ; pas "paid", "valid" ni "void"
+_ID_COLUMN_RE = re.compile(r"(^|_)[iI][dD]$|[a-z]I[dD]$")
+
+# Début de l'intervalle de `width` secondes contenant la colonne {column}, par dialecte
+_BUCKET_EXPRESSIONS = {
+    "mysql": "FROM_UNIXTIME(FLOOR(UNIX_TIMESTAMP({column}) / {width}) * {width})",
+    "postgresql": "TIMESTAMP 'epoch' + FLOOR(EXTRACT(EPOCH FROM {column}) / {width}) * {width} * INTERVAL '1 second'",
+    "mssql": "DATEADD(second, CAST(DATEDIFF_BIG(second, '19700101', {column}) / {width} * {width} AS INT), '19700101')",
+    "sqlite": "datetime(CAST(strftime('%s', {column}) AS INTEGER) / {width} * {width}, 'unixepoch')",
+}
+
+
+def _is_identifier(df: pd.DataFrame, column: str) -> bool:
+    # Une colonne entière nommée comme un identifiant (ArtistId, customer_id...) est une catégorie
+    return pd.api.types.is_integer_dtype(df[column]) and bool(_ID_COLUMN_RE.search(str(column)))
+
+
+def infer_chart(df: pd.DataFrame):
+    # Retourne (type, x, [y...]) ou None si le résultat ne se prête pas à un graphique
+    if len(df) < 2 or len(set(df.columns)) != len(df.columns):
+        return None
+    dates = [c for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])]
+    numbers = [c for c in df.columns
+               if pd.api.types.is_numeric_dtype(df[c]) and not pd.api.types.is_bool_dtype(df[c])
+               and not _is_identifier(df, c)]
+    categories = [c for c in df.columns if c not in dates and c not in numbers]
+    if dates and numbers:
+        return "line", dates[0], numbers[:MAX_SERIES]
+    if categories and numbers:
+        return "bar", categories[0], numbers[:MAX_SERIES]
+    if len(numbers) >= 2:
+        return "scatter", numbers[0], numbers[1:2]
+    return None
+
+
+def lttb(x: np.ndarray, y: np.ndarray, threshold: int) -> np.ndarray:
+    # Largest-Triangle-Three-Buckets : indices des points qui conservent la forme de la courbe
+    n = len(x)
+    if threshold >= n or threshold < 3:
+        return np.arange(n)
+    selected = np.empty(threshold, dtype=np.int64)
+    selected[0], selected[-1] = 0, n - 1
+    edges = np.linspace(1, n - 1, threshold - 1).astype(np.int64)
+    previous = 0
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        # Moyenne de l'intervalle suivant (le dernier point pour le dernier intervalle)
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_x, next_y = x[end:next_end].mean(), y[end:next_end].mean()
+        area = np.abs((x[previous] - next_x) * (y[start:end] - y[previous])
+                      - (x[previous] - x[start:end]) * (next_y - y[previous]))
+        previous = start + int(np.argmax(area))
+        selected[i + 1] = previous
+    return selected
+
+
+def _downsample_line(df: pd.DataFrame, x: str, ys: list, max_points: int) -> pd.DataFrame:
+    # Chaque série garde sa part du budget ; les points retenus sont réunis
+    positions = df[x].astype("int64").to_numpy(dtype=float)
+    budget = max(3, max_points // len(ys))
+    keep = set()
+    for y in ys:
+        values = df[y].to_numpy(dtype=float)
+        valid = np.flatnonzero(~np.isnan(values))
+        keep.update(valid[lttb(positions[valid], values[valid], budget)].tolist())
+    return df.iloc[sorted(keep)]
+
+
+def bucketed_query(query: str, dialect: str, quote, x: str, ys: list, width: int):
+    # Agrège la requête d'origine par intervalles de temps : la base ne renvoie qu'un point par intervalle
+    expression = _BUCKET_EXPRESSIONS.get(dialect)
+    if expression is None:
+        return None
+    bucket = expression.format(column=quote(x), width=int(width))
+    averages = ", ".join(f"AVG({quote(y)}) AS {quote(y)}" for y in ys)
+    source = query.strip().rstrip(";")
+    return (f"SELECT {bucket} AS {quote(x)}, {averages} FROM ({source}) AS chart_source "
+            f"WHERE {quote(x)} IS NOT NULL GROUP BY {bucket} ORDER BY 1")
+
+
+def _aggregate_in_database(db, query: str, x: str, ys: list, max_points: int, handle=None, connect=None):
+    quote = db._engine.dialect.identifier_preparer.quote
+    source = query.strip().rstrip(";")
+    bounds, _ = fetch_result(
+        db, f"SELECT MIN({quote(x)}) AS low, MAX({quote(x)}) AS high FROM ({source}) AS chart_source",
+        1, handle, connect,
+    )
+    low, high = pd.to_datetime(bounds.iloc[0]["low"]), pd.to_datetime(bounds.iloc[0]["high"])
+    # Les intervalles sont alignés sur l'epoch : une étendue de (max_points - 1) largeurs
+    # en touche au plus max_points
+    span = math.ceil((high - low).total_seconds())
+    width = max(1, math.ceil(span / max(1, max_points - 1)))
+    aggregated = bucketed_query(query, db._engine.dialect.name, quote, x, ys, width)
+    if aggregated is None:
+        return None
+    df, _ = fetch_result(db, aggregated, max_points, handle, connect)
+    df[x] = pd.to_datetime(df[x])
+    return df
+
+
+def build_chart(df: pd.DataFrame, truncated: bool = False, db=None, query: str = None,
+                max_points: int = DEFAULT_CHART_MAX_POINTS, max_bars: int = DEFAULT_CHART_MAX_BARS,
+                handle=None, connect=None):
+    # Retourne {"type", "x", "y", "data", "rows", "method"} ou None.
+    # rows est le nombre de lignes représentées, method la réduction appliquée (None si aucune).
+    # Mêmes types que le profil du résultat (dates SQLite en texte, DECIMAL...)
+    df = coerce_types(df.copy())
+    shape = infer_chart(df)
+    if shape is None:
+        return None
+    kind, x, ys = shape
+    data, method, rows = df[[x] + ys], None, len(df)
+
+    if kind == "line":
+        data = data.dropna(subset=[x]).sort_values(x, kind="stable")
+        if truncated and db is not None and query:
+            # Le résultat n'a pas été lu en entier : seule la base voit toute la série
+            try:
+                aggregated = _aggregate_in_database(db, query, x, ys, max_points, handle, connect)
+            except QueryCancelled:
+                raise
+            except Exception:
+                # Requête non agrégeable (ORDER BY dans une sous-requête SQL Server...) : réduction locale
+                aggregated = None
+            if aggregated is not None:
+                data, method, rows = aggregated, "sql", None
+        if method is None and len(data) > max_points:
+            data, method = _downsample_line(data, x, ys, max_points), "lttb"
+    elif kind == "bar":
+        if len(data) > max_bars:
+            data, method = data.nlargest(max_bars, ys[0]), "top"
+        data = data.assign(**{x: data[x].astype(str)})
+    elif len(data) > max_points:
+        data, method = data.sample(max_points, random_state=0).sort_index(), "sample"
+
+    return {"type": kind, "x": x, "y": ys, "data": data.reset_index(drop=True),
+            "rows": rows, "truncated": truncated, "method": method}
+
+
+def describe_chart(chart: dict) -> str:
+    # Légende indiquant comment le graphique a été réduit
+    points = len(chart["data"])
+    more = "+" if chart["truncated"] else ""
+    if chart["method"] == "sql":
+        return f"{points} time buckets aggregated by the database (average per bucket)"
+    if chart["method"] == "lttb":
+        return f"{points} of {chart['rows']}{more} points shown (LTTB downsampling)"
+    if chart["method"] == "sample":
+        return f"{points} of {chart['rows']}{more} points shown (random sample)"
+    if chart["method"] == "top":
+        return f"Top {points} of {chart['rows']}{more} rows by {chart['y'][0]}"
+    if chart["truncated"]:
+        return f"First {chart['rows']} rows shown"
+    return ""
+
+
+def chart_to_json(chart: dict) -> dict:
+    # Représentation JSON pour le backend HTTP
+    return {**chart, "data": chart["data"].to_json(orient="split", date_format="iso", index=False)}
+
+
+def chart_from_json(payload: dict) -> dict:
+    data = pd.read_json(io.StringIO(payload["data"]), orient="split")
+    if payload["type"] == "line":
+        data[payload["x"]] = pd.to_datetime(data[payload["x"]])
+    elif payload["type"] == "bar":
+        data[payload["x"]] = data[payload["x"]].astype(str)
+    return {**payload, "data": data}
@@ -0,0 +1,217 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+from dotenv import load_dotenv
+from fastapi import FastAPI, HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+from langchain_core.messages import AIMessage, HumanMessage
+from pydantic import BaseModel
+
+from auto_chart import chart_to_json
+from llm_scheduler import get_scheduler
+from llm_usage import TokenUsage
+from pipeline import build_database_uri, error_message, get_response, init_database, stream_response
+from query_control import cancel_run
+from singleflight import get_single_flight
+
+# Backend HTTP partagé par plusieurs répliques de l'interface Streamlit.
+# Les pools de connexions, le schéma, les exemples et le planificateur LLM
+# vivent dans ce processus ; l'interface ne garde qu'un identifiant de connexion.
+#
+# Lancement : uvicorn backend:app --host 0.0.0.0 --port 8000
+#
+# Le pipeline est bloquant (LLM, base de données) : il tourne sur un pool de threads
+# dédié, et les flux sont lus de façon asynchrone. Le pool de threads d'anyio reste
+# libre pour /cancel et /connect même quand toutes les sessions attendent le LLM.
+
+DEFAULT_BACKEND_WORKERS = 64
+DEFAULT_MAX_CONNECTIONS = 256
+DISCONNECT_POLL_INTERVAL = 0.5
+
+load_dotenv()
+
+app = FastAPI(title="Chat with Database backend")
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("BACKEND_WORKERS", DEFAULT_BACKEND_WORKERS)),
+                               thread_name_prefix="pipeline")
+
+# identifiant -> paramètres de connexion, du moins au plus récemment utilisé.
+# Les bases elles-mêmes sont gardées (et retirées) par le cache de pipeline.init_database.
+_connections = OrderedDict()
+_connections_lock = threading.Lock()
+
+
+class ConnectRequest(BaseModel):
+    db_type: str
+    user: str = ""
+    password: str = ""
+    host: str = ""
+    port: str = ""
+    database: str
+    replicas: str = ""
+
+
+class ChatMessage(BaseModel):
+    role: str  # "human" ou "ai"
+    content: str
+
+
+class ChatRequest(BaseModel):
+    connection_id: str
+    question: str
+    chat_history: List[ChatMessage] = []
+    llm_type: str
+    api_key: str
+    model: Optional[str] = None
+    user: str = "anonymous"
+    run_id: Optional[str] = None  # identifiant du tour, pour l'annuler avec /cancel
+
+
+class CancelRequest(BaseModel):
+    run_id: str
+
+
+def get_connection(connection_id: str) -> tuple:
+    with _connections_lock:
+        fields = _connections.get(connection_id)
+        if fields is not None:
+            _connections.move_to_end(connection_id)
+    if fields is None:
+        raise HTTPException(status_code=404, detail="Unknown connection. Please connect to the database again.")
+    return fields
+
+
+def to_messages(chat_history: List[ChatMessage]) -> list:
+    return [AIMessage(content=m.content) if m.role == "ai" else HumanMessage(content=m.content) for m in chat_history]
+
+
+@app.get("/health")
+async def health():
+    return {"status": "ok"}
+
+
+@app.get("/stats")
+async def stats():
+    return {"llm_scheduler": get_scheduler().stats(), "single_flight": get_single_flight().stats()}
+
+
+@app.post("/connect")
+async def connect(request: ConnectRequest):
+    fields = (request.db_type, request.user, request.password, request.host, request.port, request.database)
+    try:
+        await run_in_threadpool(init_database, *fields, request.replicas)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=f"Failed to connect to database: {str(e)}")
+    # Même configuration, même identifiant : les sessions partagent le pool du backend
+    connection_id = hashlib.sha256(f"{build_database_uri(*fields)}|{request.replicas}".encode()).hexdigest()
+    with _connections_lock:
+        _connections[connection_id] = fields + (request.replicas,)
+        _connections.move_to_end(connection_id)
+        while len(_connections) > int(os.getenv("BACKEND_MAX_CONNECTIONS", DEFAULT_MAX_CONNECTIONS)):
+            _connections.popitem(last=False)
+    return {"connection_id": connection_id}
+
+
+@app.post("/chat")
+async def chat(request: ChatRequest, http_request: Request):
+    fields = get_connection(request.connection_id)
+    run_id = request.run_id or uuid.uuid4().hex
+    usage = TokenUsage()
+    charts = []
+
+    def answer():
+        # init_database retrouve la base en cache (ou la reconnecte si elle en a été retirée)
+        return get_response(
+            request.question, init_database(*fields), to_messages(request.chat_history),
+            request.llm_type, request.api_key, request.model, request.user, None, run_id, usage,
+            charts.append,
+        )
+
+    future = asyncio.get_running_loop().run_in_executor(_executor, answer)
+    while True:
+        done, _ = await asyncio.wait({future}, timeout=DISCONNECT_POLL_INTERVAL)
+        if done:
+            break
+        if await http_request.is_disconnected():
+            # Client parti : sa requête SQL est annulée au lieu de tourner jusqu'au bout
+            await run_in_threadpool(cancel_run, run_id)
+            return None
+    response = future.result()
+    return {"response": response, "usage": usage.as_dict(), "chart": chart_to_json(charts[0]) if charts else None}
+
+
+@app.post("/chat/stream")
+async def chat_stream(request: ChatRequest):
+    # Flux NDJSON : {"type": "queue", "position": n}, {"type": "token", "content": ...},
+    # {"type": "chart", "chart": ...}, {"type": "usage", ...} puis {"type": "done"}
+    fields = get_connection(request.connection_id)
+    run_id = request.run_id or uuid.uuid4().hex
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+    stopped = threading.Event()
+    usage = TokenUsage()
+
+    def emit(event):
+        try:
+            loop.call_soon_threadsafe(events.put_nowait, event)
+        except RuntimeError:
+            pass  # boucle fermée (arrêt du serveur)
+
+    def produce():
+        try:
+            chunks = stream_response(
+                request.question, init_database(*fields), to_messages(request.chat_history), request.llm_type,
+                request.api_key, request.model, request.user,
+                lambda position: emit({"type": "queue", "position": position}),
+                run_id,
+                usage,
+                lambda chart: emit({"type": "chart", "chart": chart_to_json(chart)}),
+            )
+            try:
+                for chunk in chunks:
+                    if stopped.is_set():
+                        return
+                    emit({"type": "token", "content": chunk})
+            finally:
+                # Libère la place du planificateur LLM si le flux est abandonné
+                chunks.close()
+            emit({"type": "usage", **usage.as_dict()})
+        except Exception as e:
+            emit({"type": "token", "content": error_message(e)})
+        finally:
+            emit({"type": "done"})
+
+    loop.run_in_executor(_executor, produce)
+
+    async def consume():
+        finished = False
+        try:
+            while True:
+                event = await events.get()
+                yield json.dumps(event) + "\n"
+                if event["type"] == "done":
+                    finished = True
+                    return
+        finally:
+            if not finished:
+                # Client déconnecté : on arrête le producteur, et le run annulé quitte la file
+                # du LLM ou voit sa requête SQL annulée
+                stopped.set()
+                loop.run_in_executor(None, cancel_run, run_id)
+
+    return StreamingResponse(consume(), media_type="application/x-ndjson")
+
+
+@app.post("/cancel")
+async def cancel(request: CancelRequest):
+    # Annule le tour (nouvelle question, bouton Stop...) : sa requête SQL en cours ou à venir
+    cancelled = await run_in_threadpool(cancel_run, request.run_id)
+    return {"cancelled": cancelled}
@@ -0,0 +1,86 @@
+import json
+import os
+
+import requests
+from langchain_core.messages import AIMessage
+
+from auto_chart import chart_from_json
+
+# Client du backend HTTP (backend.py). Quand BACKEND_URL est défini, l'interface
+# Streamlit lui délègue la connexion et les questions au lieu d'exécuter le pipeline.
+
+DEFAULT_TIMEOUT = 300
+
+
+def backend_url():
+    url = os.getenv("BACKEND_URL", "").strip()
+    return url.rstrip("/") or None
+
+
+def is_enabled() -> bool:
+    return backend_url() is not None
+
+
+def _raise_for_status(response):
+    if response.status_code >= 400:
+        try:
+            detail = response.json().get("detail", response.text)
+        except ValueError:
+            detail = response.text
+        raise RuntimeError(detail)
+
+
+def connect(db_type: str, user: str, password: str, host: str, port: str, database: str, replicas: str = "") -> str:
+    response = requests.post(f"{backend_url()}/connect", json={
+        "db_type": db_type,
+        "user": user,
+        "password": password,
+        "host": host,
+        "port": port,
+        "database": database,
+        "replicas": replicas,
+    }, timeout=DEFAULT_TIMEOUT)
+    _raise_for_status(response)
+    return response.json()["connection_id"]
+
+
+def cancel(run_id: str) -> bool:
+    response = requests.post(f"{backend_url()}/cancel", json={"run_id": run_id}, timeout=DEFAULT_TIMEOUT)
+    _raise_for_status(response)
+    return response.json()["cancelled"]
+
+
+def serialize_history(chat_history: list) -> list:
+    return [{"role": "ai" if isinstance(m, AIMessage) else "human", "content": m.content} for m in chat_history]
+
+
+def stream_chat(connection_id: str, question: str, chat_history: list, llm_type: str, api_key: str,
+                model: str = None, user: str = "anonymous", on_wait=None, run_id: str = None, usage=None,
+                on_chart=None):
+    # Générateur des morceaux de réponse ; la position dans la file est transmise à on_wait,
+    # le graphique du résultat à on_chart et les tokens consommés sont ajoutés à usage (llm_usage.TokenUsage)
+    with requests.post(f"{backend_url()}/chat/stream", json={
+        "connection_id": connection_id,
+        "question": question,
+        "chat_history": serialize_history(chat_history),
+        "llm_type": llm_type,
+        "api_key": api_key,
+        "model": model,
+        "user": user,
+        "run_id": run_id,
+    }, stream=True, timeout=DEFAULT_TIMEOUT) as response:
+        _raise_for_status(response)
+        for line in response.iter_lines(decode_unicode=True):
+            if not line:
+                continue
+            event = json.loads(line)
+            if event["type"] == "queue" and on_wait is not None:
+                on_wait(event["position"])
+            elif event["type"] == "token":
+                yield event["content"]
+            elif event["type"] == "chart" and on_chart is not None:
+                on_chart(chart_from_json(event["chart"]))
+            elif event["type"] == "usage" and usage is not None:
+                usage.add(event["prompt_tokens"], event["cached_tokens"], event["completion_tokens"])
+            elif event["type"] == "done":
+                return
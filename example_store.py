@@ -0,0 +1,121 @@
+import json
+import math
+import os
+import re
+import threading
+from collections import Counter
+
+
+# Stockage local des couples (question, SQL) qui ont été exécutés avec succès,
+# indexés avec BM25 pour retrouver les exemples les plus proches d'une question.
+# Le fichier est un journal JSON Lines : chaque exemple y est ajouté en fin de fichier
+# et l'index est mis à jour incrémentalement, sans réécrire ni réindexer le corpus.
+
+DEFAULT_EXAMPLES_PATH = "examples.jsonl"
+DEFAULT_EXAMPLES_K = 3
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(text.lower())
+
+
+def normalize_sql(sql: str) -> str:
+    return " ".join(sql.strip().rstrip(";").split())
+
+
+class _Index:
+    # Index BM25 d'une connexion
+    def __init__(self):
+        self.examples = []   # {"question", "sql"}
+        self.positions = {}  # question en minuscules -> position dans examples
+        self.docs = []       # tokens de chaque question
+        self.df = Counter()  # fréquences documentaires
+        self.total_len = 0
+
+    def add(self, question: str, sql: str):
+        position = self.positions.get(question.lower())
+        if position is not None:
+            # Une question déjà connue garde la dernière requête qui a fonctionné
+            self.examples[position]["sql"] = sql
+            return
+        doc = Counter(tokenize(question))
+        self.positions[question.lower()] = len(self.examples)
+        self.examples.append({"question": question, "sql": sql})
+        self.docs.append(doc)
+        self.df.update(doc.keys())
+        self.total_len += sum(doc.values())
+
+
+class ExampleStore:
+    def __init__(self, path: str, k1: float = 1.5, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._index = {}  # connexion -> _Index
+        self._load()
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    entry = json.loads(line)
+                    self._index.setdefault(entry["connection"], _Index()).add(entry["question"], entry["sql"])
+
+    def add(self, connection: str, question: str, sql: str):
+        question = question.strip()
+        sql = normalize_sql(sql)
+        if not question or not sql:
+            return
+        with self._lock:
+            index = self._index.setdefault(connection, _Index())
+            position = index.positions.get(question.lower())
+            if position is not None and index.examples[position]["sql"] == sql:
+                return
+            index.add(question, sql)
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(json.dumps({"connection": connection, "question": question, "sql": sql}, ensure_ascii=False) + "\n")
+
+    def search(self, connection: str, question: str, k: int = DEFAULT_EXAMPLES_K) -> list:
+        terms = set(tokenize(question))
+        with self._lock:
+            index = self._index.get(connection)
+            if index is None or not index.docs:
+                return []
+            n = len(index.docs)
+            avg_len = index.total_len / n or 1
+            scores = []
+            for i, doc in enumerate(index.docs):
+                doc_len = sum(doc.values())
+                score = 0.0
+                for term in terms:
+                    tf = doc.get(term, 0)
+                    if not tf:
+                        continue
+                    df = index.df[term]
+                    idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+                    score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * doc_len / avg_len))
+                if score > 0:
+                    scores.append((score, i))
+            scores.sort(reverse=True)
+            return [dict(index.examples[i]) for _, i in scores[:k]]
+
+
+def format_examples(examples: list) -> str:
+    return "\n".join(f"Question: {e['question']}\nSQL Query: {e['sql']}" for e in examples)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_example_store() -> ExampleStore:
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ExampleStore(os.getenv("EXAMPLES_PATH", DEFAULT_EXAMPLES_PATH))
+        return _store
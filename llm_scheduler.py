@@ -0,0 +1,243 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from itertools import count
+
+
+# Planificateur partagé par toutes les sessions Streamlit du processus.
+# Le module est importé une seule fois, donc l'instance ci-dessous survit
+# aux reruns du script et voit les appels LLM de tous les utilisateurs.
+
+DEFAULT_MAX_CONCURRENCY = 4
+DEFAULT_TOKENS_PER_MINUTE = 60000
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_BASE = 1.0
+DEFAULT_BACKOFF_MAX = 30.0
+CHECK_INTERVAL = 0.5  # secondes entre deux appels de check pendant l'attente
+
+
+def estimate_tokens(text) -> int:
+    # Approximation grossière : ~4 caractères par token
+    return max(1, len(str(text)) // 4)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    status = getattr(error, "status_code", None) or getattr(getattr(error, "response", None), "status_code", None)
+    if status == 429:
+        return True
+    name = type(error).__name__.lower()
+    message = str(error).lower()
+    return "ratelimit" in name or "rate limit" in message or "rate_limit" in message
+
+
+class LLMScheduler:
+    def __init__(self, max_concurrency: int, tokens_per_minute: int,
+                 max_retries: int = DEFAULT_MAX_RETRIES,
+                 backoff_base: float = DEFAULT_BACKOFF_BASE,
+                 backoff_max: float = DEFAULT_BACKOFF_MAX):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+
+        self._cond = threading.Condition()
+        self._tickets = count()
+        self._queues = {}         # user -> deque de tickets en attente
+        self._rotation = deque()  # ordre round-robin des utilisateurs en attente
+        self._active = 0
+        self._window = deque()    # [timestamp, tokens] sur la dernière minute
+
+    def _purge_window(self, now: float):
+        while self._window and now - self._window[0][0] >= 60:
+            self._window.popleft()
+
+    def _tokens_available(self, tokens: int, now: float) -> bool:
+        if not self.tokens_per_minute:
+            return True
+        self._purge_window(now)
+        used = sum(t for _, t in self._window)
+        # Une requête plus grosse que le budget passe seule, sinon elle attendrait indéfiniment
+        return not self._window or used + tokens <= self.tokens_per_minute
+
+    def _next_wait(self, now: float) -> float:
+        if not self._window:
+            return 1.0
+        return max(0.05, 60 - (now - self._window[0][0]))
+
+    def _order(self):
+        # Ordre de service équitable : un ticket par utilisateur et par tour
+        queues = [list(self._queues[user]) for user in self._rotation]
+        order = []
+        depth = 0
+        while True:
+            layer = [q[depth] for q in queues if depth < len(q)]
+            if not layer:
+                return order
+            order.extend(layer)
+            depth += 1
+
+    def stats(self) -> dict:
+        with self._cond:
+            self._purge_window(time.monotonic())
+            return {
+                "active": self._active,
+                "waiting": sum(len(q) for q in self._queues.values()),
+                "tokens_last_minute": sum(t for _, t in self._window),
+            }
+
+    def _acquire(self, user: str, tokens: int, on_wait=None, check=None):
+        # Retourne l'entrée de la fenêtre de tokens, corrigée par _settle une fois l'appel terminé.
+        # check() est appelé à chaque réveil, même sans changement de position (budget de tokens
+        # épuisé...) : une exception (run annulé) fait quitter la file.
+        with self._cond:
+            ticket = next(self._tickets)
+            if user not in self._queues:
+                self._queues[user] = deque()
+                self._rotation.append(user)
+            self._queues[user].append(ticket)
+
+        last_position = None
+        try:
+            while True:
+                if check is not None:
+                    check()
+                with self._cond:
+                    now = time.monotonic()
+                    head_user = self._rotation[0]
+                    is_next = self._queues[head_user][0] == ticket
+                    if is_next and self._active < self.max_concurrency and self._tokens_available(tokens, now):
+                        return self._take(user, tokens)
+                    position = self._order().index(ticket) + 1 if on_wait is not None else None
+                    if position == last_position:
+                        timeout = self._next_wait(now) if is_next and self._active < self.max_concurrency else 1.0
+                        self._cond.wait(min(timeout, CHECK_INTERVAL) if check is not None else timeout)
+                        continue
+                # Le callback (Streamlit, flux HTTP) est appelé hors du verrou : s'il est lent,
+                # il ne bloque pas les autres sessions
+                last_position = position
+                on_wait(position)
+        except BaseException:
+            # Rerun Streamlit ou erreur du callback : on libère la place dans la file
+            with self._cond:
+                self._drop(user, ticket)
+            raise
+
+    def _take(self, user: str, tokens: int) -> list:
+        self._queues[user].popleft()
+        self._rotation.popleft()
+        if self._queues[user]:
+            self._rotation.append(user)
+        else:
+            del self._queues[user]
+        self._active += 1
+        entry = [time.monotonic(), tokens]
+        self._window.append(entry)
+        self._cond.notify_all()
+        return entry
+
+    def _settle(self, entry: list, tokens: int):
+        # Remplace l'estimation du prompt par les tokens réellement consommés (prompt + réponse)
+        with self._cond:
+            entry[1] = tokens
+            self._cond.notify_all()
+
+    def _drop(self, user: str, ticket):
+        self._queues[user].remove(ticket)
+        if not self._queues[user]:
+            del self._queues[user]
+            self._rotation.remove(user)
+        self._cond.notify_all()
+
+    def _release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter" : délai aléatoire entre 0 et le plafond exponentiel
+        ceiling = min(self.backoff_max, self.backoff_base * (2 ** attempt))
+        return random.uniform(0, ceiling)
+
+    def run(self, user: str, fn, tokens: int = 1, on_wait=None, actual_tokens=None, check=None):
+        # actual_tokens(texte de la réponse) donne les tokens à décompter du budget une fois l'appel terminé
+        attempt = 0
+        while True:
+            entry = self._acquire(user, tokens, on_wait, check)
+            try:
+                result = fn()
+                self._settle(entry, self._consumed(tokens, getattr(result, "content", result), actual_tokens))
+                return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+            finally:
+                self._release()
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    def stream(self, user: str, fn, tokens: int = 1, on_wait=None, actual_tokens=None, check=None):
+        # La place est gardée pendant tout le flux ; on ne réessaie qu'avant le premier morceau
+        attempt = 0
+        while True:
+            started = False
+            entry = self._acquire(user, tokens, on_wait, check)
+            parts = []
+            try:
+                for chunk in fn():
+                    started = True
+                    parts.append(str(getattr(chunk, "content", chunk)))
+                    yield chunk
+                return
+            except Exception as e:
+                if started or not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+            finally:
+                if started:
+                    self._settle(entry, self._consumed(tokens, "".join(parts), actual_tokens))
+                self._release()
+            time.sleep(self._backoff(attempt))
+            attempt += 1
+
+    @staticmethod
+    def _consumed(tokens: int, text, actual_tokens=None) -> int:
+        # Usage rapporté par le fournisseur si disponible, sinon estimation du prompt et de la réponse
+        if actual_tokens is not None:
+            actual = actual_tokens(text)
+            if actual:
+                return actual
+        return tokens + estimate_tokens(text)
+
+    def wrap(self, llm, user: str, on_wait=None, check=None):
+        from langchain_core.runnables import RunnableLambda
+
+        from llm_usage import TokenUsage, with_callback
+
+        def call(prompt_value, config):
+            # config transmet les callbacks de la chaîne (comptage des tokens) au modèle
+            tokens = estimate_tokens(prompt_value.to_string() if hasattr(prompt_value, "to_string") else prompt_value)
+            usage = TokenUsage()
+            return self.run(user, lambda: llm.invoke(prompt_value, with_callback(config, usage)), tokens, on_wait,
+                            lambda text: usage.prompt_tokens + usage.completion_tokens, check)
+
+        return RunnableLambda(call)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> LLMScheduler:
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = LLMScheduler(
+                max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", DEFAULT_MAX_CONCURRENCY)),
+                tokens_per_minute=int(os.getenv("LLM_TOKENS_PER_MINUTE", DEFAULT_TOKENS_PER_MINUTE)),
+                max_retries=int(os.getenv("LLM_MAX_RETRIES", DEFAULT_MAX_RETRIES)),
+                backoff_base=float(os.getenv("LLM_BACKOFF_BASE", DEFAULT_BACKOFF_BASE)),
+                backoff_max=float(os.getenv("LLM_BACKOFF_MAX", DEFAULT_BACKOFF_MAX)),
+            )
+        return _scheduler
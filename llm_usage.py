@@ -0,0 +1,68 @@
+import threading
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+
+# Comptage des tokens renvoyés par le fournisseur pour un tour de conversation,
+# dont les tokens de prompt servis depuis son cache de préfixe.
+
+
+def with_callback(config, handler):
+    # Ajoute handler aux callbacks de config (liste, ou gestionnaire transmis par une chaîne)
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if callbacks is None:
+        config["callbacks"] = [handler]
+    elif isinstance(callbacks, list):
+        config["callbacks"] = callbacks + [handler]
+    else:
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+        config["callbacks"] = callbacks
+    return config
+
+
+class TokenUsage(BaseCallbackHandler):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.completion_tokens = 0
+
+    def on_llm_end(self, response, **kwargs):
+        self.record((response.llm_output or {}).get("token_usage") or {})
+
+    def record(self, usage: dict):
+        # Usage au format OpenAI : token_usage d'une réponse ou dernier morceau d'un flux.
+        # Une réponse sans usage (flux d'un autre fournisseur) n'est pas comptée.
+        if not usage:
+            return
+        details = usage.get("prompt_tokens_details") or {}
+        self.add(
+            usage.get("prompt_tokens") or 0,
+            details.get("cached_tokens") or usage.get("cache_read_input_tokens") or 0,
+            usage.get("completion_tokens") or 0,
+        )
+
+    def add(self, prompt_tokens: int, cached_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.calls += 1
+            self.prompt_tokens += prompt_tokens
+            self.cached_tokens += cached_tokens
+            self.completion_tokens += completion_tokens
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "cached_tokens": self.cached_tokens,
+            "completion_tokens": self.completion_tokens,
+        }
+
+    def summary(self) -> str:
+        if not self.prompt_tokens:
+            return ""
+        ratio = 100 * self.cached_tokens / self.prompt_tokens
+        return (f"Prompt tokens: {self.prompt_tokens} ({self.cached_tokens} cached, {ratio:.0f}%) · "
+                f"completion tokens: {self.completion_tokens}")
@@ -0,0 +1,296 @@
+import argparse
+import json
+import os
+import random
+import sqlite3
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import event
+from sqlalchemy.pool import Pool
+
+# Test de charge : N sessions Streamlit simulées (AppTest) passent par le login,
+# la connexion à la base et plusieurs questions, contre un faux serveur LLM
+# compatible OpenAI et une base SQLite locale (ou un MySQL de test).
+#
+# Exemple :
+#   python load_test.py --sessions 20 --turns 3 --llm-latency 0.5
+
+LOGIN_USERNAME = "admin"
+LOGIN_PASSWORD = "aze123"
+
+# Questions posées par les sessions et requêtes renvoyées par le faux LLM
+QUESTIONS = {
+    "How many artists are there?": "SELECT COUNT(*) FROM Artist",
+    "Which 3 artists have the most tracks?":
+        "SELECT ArtistId, COUNT(*) AS track_count FROM Track GROUP BY ArtistId ORDER BY track_count DESC LIMIT 3",
+    "What is the total amount of sales per day?":
+        "SELECT DATE(SoldAt) AS day, SUM(Amount) AS total FROM Sale GROUP BY DATE(SoldAt) ORDER BY day",
+    "List all sales": "SELECT SoldAt, Amount FROM Sale",
+}
+
+
+def create_sample_database(path: str, artists: int = 200, tracks: int = 5000, sales: int = 20000):
+    conn = sqlite3.connect(path)
+    conn.executescript("""
+        CREATE TABLE Artist (ArtistId INTEGER PRIMARY KEY, Name TEXT);
+        CREATE TABLE Track (TrackId INTEGER PRIMARY KEY, Name TEXT, ArtistId INTEGER, Milliseconds INTEGER);
+        CREATE TABLE Sale (SaleId INTEGER PRIMARY KEY, SoldAt TIMESTAMP, Amount REAL);
+    """)
+    conn.executemany("INSERT INTO Artist VALUES (?, ?)", [(i, f"Artist {i}") for i in range(artists)])
+    conn.executemany("INSERT INTO Track VALUES (?, ?, ?, ?)",
+                     [(i, f"Track {i}", random.randrange(artists), random.randint(60000, 400000)) for i in range(tracks)])
+    start = time.mktime((2024, 1, 1, 0, 0, 0, 0, 0, -1))
+    conn.executemany("INSERT INTO Sale VALUES (?, ?, ?)",
+                     [(i, time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(start + i * 60)), round(random.uniform(1, 100), 2))
+                      for i in range(sales)])
+    conn.commit()
+    conn.close()
+
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    # Préfixes système déjà vus : simule le cache de préfixe du fournisseur
+    seen_prefixes = set()
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        prompt = "\n".join(str(m.get("content", "")) for m in body.get("messages", []))
+        time.sleep(self.latency)
+        if "Write only the SQL query" in prompt:
+            # La question la plus récente du prompt détermine la requête
+            question = max(QUESTIONS, key=prompt.rfind)
+            content = QUESTIONS[question]
+        else:
+            content = "Here is the answer based on the query results."
+        tokens = len(prompt) // 4
+        system = next((str(m.get("content", "")) for m in body.get("messages", []) if m.get("role") == "system"), "")
+        cached = len(system) // 4 if system in self.seen_prefixes else 0
+        self.seen_prefixes.add(system)
+        usage = {"prompt_tokens": tokens, "completion_tokens": len(content) // 4,
+                 "total_tokens": tokens + len(content) // 4,
+                 "prompt_tokens_details": {"cached_tokens": cached}}
+        if body.get("stream"):
+            self._stream(body, content, usage)
+            return
+        payload = json.dumps({
+            "id": "chatcmpl-load-test",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "fake"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": usage,
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _stream(self, body, content, usage):
+        # Réponse en Server-Sent Events, un mot par morceau, comme l'API OpenAI avec stream=True ;
+        # l'usage suit dans un dernier morceau sans choix si stream_options.include_usage est demandé
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, word in enumerate(content.split(" ")):
+            chunk = {
+                "id": "chatcmpl-load-test",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "delta": {"content": word if i == 0 else f" {word}"}, "finish_reason": None}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if (body.get("stream_options") or {}).get("include_usage"):
+            chunk = {
+                "id": "chatcmpl-load-test",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [],
+                "usage": usage,
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        self.wfile.write(b"data: [DONE]\n\n")
+
+
+def start_fake_llm(latency: float) -> ThreadingHTTPServer:
+    handler = type("Handler", (FakeLLMHandler,), {"latency": latency, "seen_prefixes": set()})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+class ConnectionCounter:
+    # Compte les connexions DBAPI ouvertes par tous les pools SQLAlchemy du processus
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.opened = 0
+        self.closed = 0
+        self.checked_out = 0
+        self.peak_checked_out = 0
+        self.peak_open = 0
+
+    def install(self):
+        event.listen(Pool, "connect", self._on_connect)
+        event.listen(Pool, "close", self._on_close)
+        event.listen(Pool, "checkout", self._on_checkout)
+        event.listen(Pool, "checkin", self._on_checkin)
+
+    def _on_connect(self, *args):
+        with self._lock:
+            self.opened += 1
+            self.peak_open = max(self.peak_open, self.opened - self.closed)
+
+    def _on_close(self, *args):
+        with self._lock:
+            self.closed += 1
+
+    def _on_checkout(self, *args):
+        with self._lock:
+            self.checked_out += 1
+            self.peak_checked_out = max(self.peak_checked_out, self.checked_out)
+
+    def _on_checkin(self, *args):
+        with self._lock:
+            self.checked_out -= 1
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return values[index]
+
+
+def run_session(args, session_id: int, ready: threading.Barrier):
+    from streamlit.testing.v1 import AppTest
+
+    at = AppTest.from_file(args.app, default_timeout=args.timeout)
+    at.run()
+    at.text_input[0].input(LOGIN_USERNAME)
+    at.text_input[1].input(LOGIN_PASSWORD)
+    at.button[0].click().run()
+    if at.exception:
+        raise RuntimeError(f"session {session_id}: login failed: {at.exception[0].message}")
+
+    at.selectbox(key="db_type").select(args.db_type)
+    at.text_input(key="Host").input(args.host)
+    at.text_input(key="Port").input(args.port)
+    at.text_input(key="User").input(args.user)
+    at.text_input(key="Password").input(args.password)
+    at.text_input(key="Database").input(args.database)
+    at.selectbox(key="llm_type").select("OpenAI")
+    at.text_input(key="api_key").input("load-test")
+    at.sidebar.button[0].click().run()
+    if "db" not in at.session_state:
+        raise RuntimeError(f"session {session_id}: connection failed")
+
+    # Toutes les sessions commencent leurs questions en même temps
+    ready.wait()
+    latencies = []
+    questions = list(QUESTIONS)
+    for turn in range(args.turns):
+        question = questions[(session_id + turn) % len(questions)]
+        start = time.perf_counter()
+        at.chat_input[0].set_value(question).run()
+        latencies.append(time.perf_counter() - start)
+        if at.exception:
+            raise RuntimeError(f"session {session_id}: {at.exception[0].message}")
+    return at, latencies
+
+
+def mysql_threads_connected(args):
+    from sqlalchemy import create_engine, text
+    engine = create_engine(f"mysql+mysqlconnector://{args.user}:{args.password}@{args.host}:{args.port}/{args.database}")
+    with engine.connect() as connection:
+        value = connection.execute(text("SHOW STATUS LIKE 'Threads_connected'")).fetchone()[1]
+    engine.dispose()
+    return int(value)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the Streamlit app with concurrent simulated sessions")
+    parser.add_argument("--app", default="main.py")
+    parser.add_argument("--sessions", type=int, default=10)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="Seconds the fake LLM waits before answering")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--db-type", default="SQLite", choices=["SQLite", "MySQL"])
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", default="3306")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="admin")
+    parser.add_argument("--database", default=None, help="SQLite file or MySQL database (a sample SQLite file is created by default)")
+    args = parser.parse_args()
+
+    if args.database is None:
+        if args.db_type != "SQLite":
+            parser.error("--database is required for MySQL")
+        args.database = os.path.join(tempfile.mkdtemp(), "load_test.db")
+        create_sample_database(args.database)
+
+    server = start_fake_llm(args.llm_latency)
+    os.environ["OPENAI_API_BASE"] = f"http://127.0.0.1:{server.server_port}/v1"
+    os.environ["OPENAI_API_KEY"] = "load-test"
+    os.environ.setdefault("EXAMPLES_PATH", os.path.join(tempfile.mkdtemp(), "examples.jsonl"))
+
+    counter = ConnectionCounter()
+    counter.install()
+    rss_before = rss_bytes()
+    mysql_before = mysql_threads_connected(args) if args.db_type == "MySQL" else None
+
+    ready = threading.Barrier(args.sessions + 1)
+    with ThreadPoolExecutor(max_workers=args.sessions) as pool:
+        futures = [pool.submit(run_session, args, i, ready) for i in range(args.sessions)]
+        ready.wait(timeout=args.timeout)
+        start = time.perf_counter()
+        results = [f.result() for f in futures]
+        elapsed = time.perf_counter() - start
+
+    # Les AppTest restent référencés : la mémoire mesurée inclut l'état de chaque session
+    rss_after = rss_bytes()
+    mysql_after = mysql_threads_connected(args) if args.db_type == "MySQL" else None
+    latencies = [latency for _, session_latencies in results for latency in session_latencies]
+
+    report = {
+        "sessions": args.sessions,
+        "turns": len(latencies),
+        "throughput_turns_per_s": round(len(latencies) / elapsed, 3) if elapsed else 0.0,
+        "latency_p50_s": round(percentile(latencies, 50), 3),
+        "latency_p99_s": round(percentile(latencies, 99), 3),
+        "latency_mean_s": round(statistics.mean(latencies), 3) if latencies else 0.0,
+        "memory_per_session_mb": round((rss_after - rss_before) / args.sessions / 2 ** 20, 2),
+        "db_connections_opened": counter.opened,
+        "db_connections_open_peak": counter.peak_open,
+        "db_connections_in_use_peak": counter.peak_checked_out,
+    }
+    if mysql_before is not None:
+        report["mysql_threads_connected_delta"] = mysql_after - mysql_before
+    print(json.dumps(report, indent=2))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
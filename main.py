@@ -1,139 +1,14 @@
+import uuid
 import streamlit as st
-import urllib.parse
 from dotenv import load_dotenv
 from langchain_core.messages import AIMessage, HumanMessage
-from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_community.utilities import SQLDatabase
-from langchain_core.output_parsers import StrOutputParser
-from langchain_openai import ChatOpenAI
-from langchain_groq import ChatGroq
-import sqlalchemy.exc
 
-# Fonction pour initialiser la base de données en fonction du type
-def init_database(db_type: str, user: str, password: str, host: str, port: str, database: str) -> SQLDatabase:
-    try:
-        if db_type == "MySQL":
-            db_uri = f"mysql+mysqlconnector://{user}:{password}@{host}:{port}/{database}"
-        elif db_type == "PostgreSQL":
-            db_uri = f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
-        elif db_type == "SQL Server":
-            driver = 'ODBC Driver 17 for SQL Server'
-            if user and password:
-                driver = '{ODBC Driver 17 for SQL Server}'
-                params = urllib.parse.quote_plus(f"DRIVER={driver};SERVER={host};DATABASE={database};UID={user};PWD={password}")
-                db_uri = f"mssql+pyodbc:///?odbc_connect={params}"
-            else:
-                db_uri = f"mssql+pyodbc://{host}/{database}?trusted_connection=yes&driver={driver}"
-        else:
-            raise ValueError("Unsupported database type")
-        
-        return SQLDatabase.from_uri(db_uri)
-    except Exception as e:
-        st.error(f"Failed to connect to database: {str(e)}")
-        return None
-
-def get_llm_chain(db, llm_type, api_key, model=None):
-    default_model = "gpt-4-0125-preview"
-  
-    template = """
-    You are a data analyst at a company. You are interacting with a user who is asking you questions about the company's database.
-    Based on the table schema below, write a SQL query that would answer the user's question. Take the conversation history into account.
-
-    <SCHEMA>{schema}</SCHEMA>
-
-    Conversation History: {chat_history}
-
-    Write only the SQL query and nothing else. Do not wrap the SQL query in any other text, not even backticks.
-
-    For example:
-    Question: which 3 artists have the most tracks?
-    SQL Query: SELECT `ArtistId`, COUNT(*) as track_count FROM `Track` GROUP BY `ArtistId` ORDER BY track_count DESC LIMIT 3;
-    Question: Name 10 artists
-    SQL Query: SELECT `Name` FROM `Artist` LIMIT 10;
-
-    Your turn:
-
-    Question: {question}
-    SQL Query:
-    """
-
-    prompt = ChatPromptTemplate.from_template(template)
-    
-    try:
-        if llm_type == "OpenAI":
-            llm = ChatOpenAI(api_key=api_key, model=model or default_model) 
-        elif llm_type == "Groq":
-            llm = ChatGroq(api_key=api_key)
-        else:
-            raise ValueError("Unsupported LLM type")
-
-        def get_schema(_):
-            return db.get_table_info()
-
-        return (
-            RunnablePassthrough.assign(schema=get_schema)
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
-    except Exception as e:
-        st.error(f"Failed to initialize LLM chain: {str(e)}")
-        return None
-
-def get_response(user_query: str, db: SQLDatabase, chat_history: list, llm_type: str, api_key: str, model: str = None):
-    sql_chain = get_llm_chain(db, llm_type, api_key, model)
-    if sql_chain is None:
-        return "Failed to initialize LLM chain. Check your LLM settings."
-
-    template = """
-    You are a data analyst at a company. You are interacting with a user who is asking you questions about the company's database.
-    Based on the table schema below, question, sql query, and sql response, write a natural language response.
-    <SCHEMA>{schema}</SCHEMA>
-
-    Conversation History: {chat_history}
-    SQL Query: <SQL>{query}</SQL>
-    User question: {question}
-    SQL Response: {response}
-    """
-
-    prompt = ChatPromptTemplate.from_template(template)
-    
-    try:
-        if llm_type == "OpenAI":
-            llm = ChatOpenAI(api_key=api_key)
-        elif llm_type == "Groq":
-            llm = ChatGroq(api_key=api_key)
-        else:
-            raise ValueError("Unsupported LLM type")
-
-        chain = (
-            RunnablePassthrough.assign(query=sql_chain).assign(
-                schema=lambda _: db.get_table_info(),
-                response=lambda vars: db.run(vars["query"]),
-            )
-            | prompt
-            | llm
-            | StrOutputParser()
-        )
-
-        return chain.invoke({
-            "question": user_query,
-            "chat_history": chat_history,
-        })
-    except sqlalchemy.exc.ProgrammingError as pe:
-        return f"SQL error: {str(pe)}"
-    except Exception as e:
-        return f"An unexpected error occurred: {str(e)}"
-
-# Initialisation des variables de session
-if "chat_history" not in st.session_state:
-    st.session_state.chat_history = [
-        AIMessage(content="Hello! I'm a SQL assistant. Ask me anything about your database."),
-    ]
-
-if 'logged_in' not in st.session_state:
-    st.session_state.logged_in = False
+import backend_client
+from auto_chart import describe_chart
+from llm_usage import TokenUsage
+from pipeline import get_response, init_database
+from query_control import cancel_run
+from singleflight import get_single_flight
 
 def login(username, password):
     # Remplacez ceci par la vérification réelle des identifiants
@@ -178,13 +53,43 @@ def show_login_page():
     if login_button:
         if login(username, password):
             st.session_state.logged_in = True
-            st.experimental_rerun()
+            st.session_state.username = username
+            st.rerun()
         else:
             st.error("Incorrect credentials. Please try again.")
 
     st.markdown('<div class="footer-text">Developed by DIGITAR</div>', unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
+def stop_previous_query():
+    # Un rerun pendant une question (bouton Stop, nouveau message, widget modifié) abandonne
+    # l'exécution précédente : on annule son tour, y compris la requête qu'il n'a pas encore
+    # lancée (génération SQL ou file d'attente du LLM en cours)
+    if not st.session_state.get("query_running"):
+        return
+    st.session_state.query_running = False
+    try:
+        if backend_client.is_enabled():
+            backend_client.cancel(st.session_state.run_id)
+        else:
+            cancel_run(st.session_state.run_id)
+    except Exception as e:
+        st.warning(f"Failed to cancel the previous query: {str(e)}")
+    if isinstance(st.session_state.chat_history[-1], HumanMessage):
+        st.session_state.chat_history.append(AIMessage(content="The query was stopped before it could be answered."))
+
+def show_chart(chart):
+    # Le graphique est déjà réduit à un nombre de points borné par le pipeline
+    if chart["type"] == "line":
+        st.line_chart(chart["data"], x=chart["x"], y=chart["y"])
+    elif chart["type"] == "bar":
+        st.bar_chart(chart["data"], x=chart["x"], y=chart["y"])
+    else:
+        st.scatter_chart(chart["data"], x=chart["x"], y=chart["y"])
+    caption = describe_chart(chart)
+    if caption:
+        st.caption(caption)
+
 def show_main_page():
     load_dotenv()
 
@@ -208,12 +113,14 @@ def show_main_page():
         st.subheader("Settings", divider=True)
         st.write("Connect to the database and start chatting.")
         
-        db_type = st.selectbox("Database Type", ["MySQL", "PostgreSQL", "SQL Server"], key="db_type")
+        db_type = st.selectbox("Database Type", ["MySQL", "PostgreSQL", "SQL Server", "SQLite"], key="db_type")
         host = st.text_input("Host", value="localhost", key="Host")
         port = st.text_input("Port", value="3306", key="Port")
         user = st.text_input("UserName", value="root", key="User")
         password = st.text_input("Password", type="password", value="admin", key="Password")
         database = st.text_input("Database", value="artist", key="Database")
+        replicas = st.text_input("Read replicas (optional)", value="", key="Replicas",
+                                 help="Comma-separated host or host:port. Generated SELECT queries run on a healthy replica.")
         
         st.subheader("LLM Configuration")
         llm_type = st.selectbox("LLM Type", ["OpenAI", "Groq"], key="llm_type")
@@ -223,29 +130,50 @@ def show_main_page():
         if st.button("Connect"):
             with st.spinner("Connecting to database..."):
                 try:
-                    db = init_database(
-                        db_type,
-                        user,
-                        password,
-                        host,
-                        port,
-                        database
-                    )
-                    if db is not None:
-                        st.session_state.db = db
+                    if backend_client.is_enabled():
+                        # Le backend garde la connexion : la session ne stocke que son identifiant
+                        st.session_state.connection_id = backend_client.connect(
+                            db_type,
+                            user,
+                            password,
+                            host,
+                            port,
+                            database,
+                            replicas
+                        )
+                        st.session_state.db = None
                         st.success("Connected to database!")
                     else:
-                        st.error("Failed to connect to the database.")
+                        db = init_database(
+                            db_type,
+                            user,
+                            password,
+                            host,
+                            port,
+                            database,
+                            replicas
+                        )
+                        if db is not None:
+                            st.session_state.db = db
+                            st.success("Connected to database!")
+                        else:
+                            st.error("Failed to connect to the database.")
                 except Exception as e:
                     st.error(f"Failed to connect to database: {str(e)}")
 
+        if not backend_client.is_enabled():
+            collapsed = get_single_flight().stats()["collapsed"]
+            st.caption(f"Duplicate in-flight requests shared: {collapsed}")
+
     st.subheader("Chat with the Database")
     st.write("Ask your database anything and get the response in natural language.")
 
-    for message in st.session_state.chat_history:
+    for index, message in enumerate(st.session_state.chat_history):
         if isinstance(message, AIMessage):
             with st.chat_message("AI"):
                 st.markdown(message.content)
+                if index in st.session_state.charts:
+                    show_chart(st.session_state.charts[index])
         elif isinstance(message, HumanMessage):
             with st.chat_message("Human"):
                 st.markdown(message.content)
@@ -258,29 +186,95 @@ def show_main_page():
             st.markdown(user_query)
             
         with st.chat_message("AI"):
+            queue_status = st.empty()
+
+            def show_queue_position(position):
+                queue_status.info(f"Waiting for the LLM... position {position} in queue")
+
+            # Cliquer sur Stop relance le script, qui annule alors la requête en cours
+            stop_placeholder = st.empty()
+            stop_placeholder.button("Stop", key="stop_query")
+            # Chaque tour a son identifiant : le run suivant l'annule sans toucher aux autres tours
+            st.session_state.run_id = uuid.uuid4().hex
+            st.session_state.query_running = True
+
             if "db" in st.session_state:
                 if "api_key" in st.session_state and "llm_type" in st.session_state:
-                    response = get_response(
-                        user_query, 
-                        st.session_state.db, 
-                        st.session_state.chat_history, 
-                        st.session_state.llm_type, 
-                        st.session_state.api_key, 
-                        st.session_state.model if st.session_state.model.strip() != "" else None
-                    )
+                    model = st.session_state.model if st.session_state.model.strip() != "" else None
+                    usage = TokenUsage()
+                    charts = []
+                    if backend_client.is_enabled():
+                        try:
+                            response = st.write_stream(backend_client.stream_chat(
+                                st.session_state.connection_id,
+                                user_query,
+                                st.session_state.chat_history,
+                                st.session_state.llm_type,
+                                st.session_state.api_key,
+                                model,
+                                st.session_state.get("username", "anonymous"),
+                                show_queue_position,
+                                st.session_state.run_id,
+                                usage,
+                                charts.append
+                            ))
+                        except Exception as e:
+                            response = f"An unexpected error occurred: {str(e)}"
+                            st.markdown(response)
+                    else:
+                        response = get_response(
+                            user_query, 
+                            st.session_state.db, 
+                            st.session_state.chat_history, 
+                            st.session_state.llm_type, 
+                            st.session_state.api_key, 
+                            model,
+                            st.session_state.get("username", "anonymous"),
+                            show_queue_position,
+                            st.session_state.run_id,
+                            usage,
+                            charts.append
+                        )
+                        st.markdown(response)
+                    queue_status.empty()
+                    if charts:
+                        show_chart(charts[0])
+                        # Conservé pour être réaffiché avec l'historique
+                        st.session_state.charts[len(st.session_state.chat_history)] = charts[0]
+                    if usage.summary():
+                        st.caption(usage.summary())
                 else:
                     response = "Please configure the LLM settings first."
+                    st.markdown(response)
             else:
                 response = "Please connect to a database first."
-            st.markdown(response)
+                st.markdown(response)
+            st.session_state.query_running = False
+            stop_placeholder.empty()
             
         st.session_state.chat_history.append(AIMessage(content=response))
 
     if st.button("Log Out"):
         st.session_state.logged_in = False
-        st.experimental_rerun()
+        st.rerun()
+
+# Le script n'affiche l'interface que lorsqu'il est lancé par Streamlit
+if __name__ == "__main__":
+    # Initialisation des variables de session
+    if "chat_history" not in st.session_state:
+        st.session_state.chat_history = [
+            AIMessage(content="Hello! I'm a SQL assistant. Ask me anything about your database."),
+        ]
+
+    if "charts" not in st.session_state:
+        st.session_state.charts = {}
+
+    if 'logged_in' not in st.session_state:
+        st.session_state.logged_in = False
+
+    stop_previous_query()
 
-if st.session_state.logged_in:
-    show_main_page()
-else:
-    show_login_page()
+    if st.session_state.logged_in:
+        show_main_page()
+    else:
+        show_login_page()
@@ -0,0 +1,428 @@
+import hashlib
+import os
+import threading
+import time
+import urllib.parse
+import weakref
+from collections import OrderedDict
+
+from langchain_core.messages import HumanMessage
+from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
+from langchain_core.runnables import RunnablePassthrough
+from langchain_community.utilities import SQLDatabase
+from langchain_core.output_parsers import StrOutputParser
+from langchain_openai import ChatOpenAI
+from langchain_groq import ChatGroq
+import sqlalchemy.exc
+from sqlalchemy import URL, create_engine
+
+from auto_chart import DEFAULT_CHART_MAX_BARS, DEFAULT_CHART_MAX_POINTS, build_chart
+from example_store import DEFAULT_EXAMPLES_K, format_examples, get_example_store, normalize_sql
+from llm_scheduler import estimate_tokens, get_scheduler
+from llm_usage import TokenUsage, with_callback
+from query_control import DEFAULT_QUERY_TIMEOUT, QueryCancelled, QueryTimeout, check_cancelled, tracked_query
+from replicas import DEFAULT_CHECK_INTERVAL, DEFAULT_MAX_LAG, ReplicaRouter, WriteRefused, is_read_query, parse_replicas, read_connection
+from result_profile import DEFAULT_MAX_FETCH_ROWS, DEFAULT_PROFILE_MAX_CHARS, DEFAULT_PROFILE_ROW_THRESHOLD, fetch_result, summarize_result
+from singleflight import SingleFlight, get_single_flight
+
+# Pipeline question -> SQL -> réponse, sans dépendance à Streamlit : il est utilisé
+# directement par l'interface ou servi par le backend HTTP (backend.py).
+# Les bases et leurs schémas sont mis en cache au niveau du processus pour que
+# toutes les sessions partagent le même pool de connexions. Au-delà de MAX_DATABASES
+# configurations, la moins récemment utilisée est retirée et ses pools fermés.
+
+DEFAULT_SCHEMA_CACHE_TTL = 300
+DEFAULT_MAX_DATABASES = 32
+
+_databases = OrderedDict()  # (uri, réplicas) -> SQLDatabase, du moins au plus récemment utilisé
+_databases_lock = threading.Lock()
+# SQLDatabase -> ReplicaRouter ; une session qui garde une base retirée du cache garde aussi son routeur
+_routers = weakref.WeakKeyDictionary()
+_schemas = {}
+_schemas_lock = threading.Lock()
+# Création des bases et des clients LLM, dédupliquée à part : les statistiques du
+# single-flight partagé ne comptent que les requêtes SQL et les générations
+_setup_flight = SingleFlight()
+MAX_LLM_CLIENTS = 64
+_llms = OrderedDict()  # (type, clé d'API, modèle) -> client LLM
+_llms_lock = threading.Lock()
+
+
+def build_database_uri(db_type: str, user: str, password: str, host: str, port: str, database: str,
+                       read_only: bool = False) -> str:
+    if db_type == "MySQL":
+        return f"mysql+mysqlconnector://{user}:{password}@{host}:{port}/{database}"
+    elif db_type == "PostgreSQL":
+        return f"postgresql+psycopg2://{user}:{password}@{host}:{port}/{database}"
+    elif db_type == "SQL Server":
+        driver = 'ODBC Driver 17 for SQL Server'
+        if user and password:
+            driver = '{ODBC Driver 17 for SQL Server}'
+            # ApplicationIntent=ReadOnly dirige la connexion vers un secondaire lisible (groupe de disponibilité)
+            intent = ";ApplicationIntent=ReadOnly" if read_only else ""
+            params = urllib.parse.quote_plus(f"DRIVER={driver};SERVER={host};DATABASE={database};UID={user};PWD={password}{intent}")
+            return f"mssql+pyodbc:///?odbc_connect={params}"
+        intent = "&ApplicationIntent=ReadOnly" if read_only else ""
+        return f"mssql+pyodbc://{host}/{database}?trusted_connection=yes&driver={driver}{intent}"
+    elif db_type == "SQLite":
+        # Base locale (tests de charge, démos) : le champ Database contient le chemin du fichier
+        return f"sqlite:///{database}"
+    raise ValueError("Unsupported database type")
+
+
+# Fonction pour initialiser la base de données en fonction du type
+def init_database(db_type: str, user: str, password: str, host: str, port: str, database: str,
+                  replicas: str = "") -> SQLDatabase:
+    # replicas : réplicas en lecture séparés par des virgules ("hote" ou "hote:port")
+    db_uri = build_database_uri(db_type, user, password, host, port, database)
+    replica_hosts = tuple(parse_replicas(replicas or "", port))
+    key = (db_uri, replica_hosts)
+    with _databases_lock:
+        if key in _databases:
+            _databases.move_to_end(key)
+            return _databases[key]
+    # La connexion et la lecture des tables peuvent prendre le temps d'un délai de connexion :
+    # elles ont lieu hors du verrou, une seule fois pour les sessions qui demandent la même base
+    return _setup_flight.do(("database",) + key, lambda: _open_database(key, db_type, user, password, database))
+
+
+def _open_database(key, db_type: str, user: str, password: str, database: str) -> SQLDatabase:
+    db_uri, replica_hosts = key
+    with _databases_lock:
+        if key in _databases:
+            return _databases[key]
+    db = SQLDatabase.from_uri(db_uri)
+    replica_engines = [
+        create_engine(build_database_uri(db_type, user, password, replica_host, replica_port, database, True))
+        for replica_host, replica_port in replica_hosts
+    ]
+    _routers[db] = ReplicaRouter(
+        db._engine,
+        replica_engines,
+        float(os.getenv("REPLICA_MAX_LAG", DEFAULT_MAX_LAG)),
+        float(os.getenv("REPLICA_CHECK_INTERVAL", DEFAULT_CHECK_INTERVAL)),
+    )
+    with _databases_lock:
+        _databases[key] = db
+        evicted = []
+        while len(_databases) > max(1, int(os.getenv("MAX_DATABASES", DEFAULT_MAX_DATABASES))):
+            evicted.append(_databases.popitem(last=False)[1])
+    for old_db in evicted:
+        _dispose(old_db)
+    return db
+
+
+def _dispose(db: SQLDatabase):
+    # Ferme les connexions inactives ; celles en cours d'utilisation le sont à leur libération.
+    # Un moteur fermé reste utilisable : une session qui garde la base rouvre une connexion.
+    router = _routers.get(db)
+    with _schemas_lock:
+        _schemas.pop(connection_key(db), None)
+    db._engine.dispose()
+    for engine in router.replica_engines if router is not None else []:
+        engine.dispose()
+
+
+def connection_key(db: SQLDatabase) -> str:
+    # Identifie la base interrogée à partir de champs non secrets (la clé est écrite dans
+    # examples.jsonl). Avec un utilisateur SQL Server, ils sont dans la chaîne odbc_connect.
+    url = db._engine.url
+    host, port, database, user = url.host, url.port, url.database, url.username
+    odbc_connect = url.query.get("odbc_connect")
+    if odbc_connect:
+        params = dict(item.split("=", 1) for item in odbc_connect.split(";") if "=" in item)
+        params = {name.strip().upper(): value for name, value in params.items()}
+        host, database, user = params.get("SERVER"), params.get("DATABASE"), params.get("UID")
+    return URL.create(url.drivername, username=user, host=host, port=port, database=database).render_as_string()
+
+
+def get_table_info(db: SQLDatabase) -> str:
+    # Le schéma (avec ses lignes d'exemple) est coûteux à lire : il est partagé entre sessions
+    ttl = float(os.getenv("SCHEMA_CACHE_TTL", DEFAULT_SCHEMA_CACHE_TTL))
+    key = connection_key(db)
+    with _schemas_lock:
+        cached = _schemas.get(key)
+        if cached is not None and time.monotonic() - cached[0] < ttl:
+            return cached[1]
+    schema = db.get_table_info()
+    with _schemas_lock:
+        _schemas[key] = (time.monotonic(), schema)
+    return schema
+
+
+def create_llm(llm_type: str, api_key: str, model: str = None):
+    # Les clients sont réutilisés d'une requête à l'autre : en créer un charge un contexte TLS,
+    # ce qui, répété par chaque requête concurrente, monopolise le GIL
+    key = (llm_type, api_key, model)
+    with _llms_lock:
+        if key in _llms:
+            _llms.move_to_end(key)
+            return _llms[key]
+    # Les requêtes simultanées sur un cache vide attendent le même client
+    llm = _setup_flight.do(("llm",) + key, lambda: _new_llm(llm_type, api_key, model))
+    with _llms_lock:
+        _llms[key] = llm
+        while len(_llms) > MAX_LLM_CLIENTS:
+            _llms.popitem(last=False)
+    return llm
+
+
+def _new_llm(llm_type: str, api_key: str, model: str = None):
+    # Les tentatives sont gérées par le planificateur partagé (backoff avec jitter)
+    if llm_type == "OpenAI":
+        if model:
+            return ChatOpenAI(api_key=api_key, model=model, max_retries=0)
+        return ChatOpenAI(api_key=api_key, max_retries=0)
+    elif llm_type == "Groq":
+        return ChatGroq(api_key=api_key, max_retries=0)
+    raise ValueError("Unsupported LLM type")
+
+
+# Exemples génériques utilisés tant qu'aucun exemple n'a été enregistré pour la base
+DEFAULT_EXAMPLES = """Question: which 3 artists have the most tracks?
+    SQL Query: SELECT `ArtistId`, COUNT(*) as track_count FROM `Track` GROUP BY `ArtistId` ORDER BY track_count DESC LIMIT 3;
+    Question: Name 10 artists
+    SQL Query: SELECT `Name` FROM `Artist` LIMIT 10;"""
+
+
+# Les prompts commencent par un préfixe stable (instructions + schéma) suivi de l'historique,
+# qui ne fait que s'allonger, puis du contenu propre au tour. Les fournisseurs peuvent ainsi
+# réutiliser leur cache de préfixe d'un tour à l'autre.
+SQL_SYSTEM_TEMPLATE = """
+    You are a data analyst at a company. You are interacting with a user who is asking you questions about the company's database.
+    Based on the table schema below, write a SQL query that would answer the user's question. Take the conversation history into account.
+
+    Write only the SQL query and nothing else. Do not wrap the SQL query in any other text, not even backticks.
+
+    <SCHEMA>{schema}</SCHEMA>
+    """
+
+SQL_QUESTION_TEMPLATE = """
+    For example:
+    {examples}
+
+    Your turn:
+
+    Question: {question}
+    SQL Query:
+    """
+
+
+def prior_history(chat_history: list, user_query: str) -> list:
+    # La question courante est souvent déjà en fin d'historique : elle ne fait pas partie du contexte
+    if chat_history and isinstance(chat_history[-1], HumanMessage) and chat_history[-1].content == user_query:
+        return chat_history[:-1]
+    return chat_history
+
+
+def get_llm_chain(db, llm_type, api_key, model=None, user="anonymous", on_wait=None, store=None, check=None):
+    # store : ExampleStore où chercher les exemples (celui du processus par défaut) ;
+    # check : appelé par le planificateur pendant l'attente du LLM (voir cancel_check)
+    default_model = "gpt-4-0125-preview"
+    examples_k = int(os.getenv("EXAMPLES_K", DEFAULT_EXAMPLES_K))
+
+    prompt = ChatPromptTemplate.from_messages([
+        ("system", SQL_SYSTEM_TEMPLATE),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", SQL_QUESTION_TEMPLATE),
+    ])
+
+    llm = create_llm(llm_type, api_key, model or default_model)
+    llm = get_scheduler().wrap(llm, user, on_wait, check)
+
+    def get_schema(_):
+        return get_table_info(db)
+
+    def get_examples(vars):
+        examples = (store or get_example_store()).search(connection_key(db), vars["question"], examples_k)
+        return format_examples(examples) if examples else DEFAULT_EXAMPLES
+
+    return (
+        RunnablePassthrough.assign(
+            schema=get_schema,
+            examples=get_examples,
+            chat_history=lambda vars: prior_history(vars["chat_history"], vars["question"]),
+        )
+        | prompt
+        | llm
+        | StrOutputParser()
+    )
+
+
+ANSWER_SYSTEM_TEMPLATE = """
+    You are a data analyst at a company. You are interacting with a user who is asking you questions about the company's database.
+    Based on the table schema below, question, sql query, and sql response, write a natural language response.
+    <SCHEMA>{schema}</SCHEMA>
+    """
+
+ANSWER_QUESTION_TEMPLATE = """
+    SQL Query: <SQL>{query}</SQL>
+    User question: {question}
+    SQL Response: {response}
+    """
+
+
+def answer_prompt() -> ChatPromptTemplate:
+    return ChatPromptTemplate.from_messages([
+        ("system", ANSWER_SYSTEM_TEMPLATE),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", ANSWER_QUESTION_TEMPLATE),
+    ])
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).rstrip("?!. ")
+
+
+def run_query(db: SQLDatabase, question: str, query: str, run_id=None, on_chart=None) -> str:
+    # on_chart reçoit le graphique du résultat (auto_chart.build_chart) s'il y en a un
+    read = is_read_query(query)
+    key = ("query", connection_key(db), normalize_sql(query))
+    if not read:
+        # Une écriture n'est jamais partagée : deux runs qui envoient le même INSERT l'exécutent chacun
+        key += (object(),)
+    timeout = float(os.getenv("QUERY_TIMEOUT", DEFAULT_QUERY_TIMEOUT))
+
+    # Le run attend la requête : il pourra l'annuler (rerun, bouton Stop, nouvelle question).
+    # S'il a déjà été annulé, la requête n'est pas lancée.
+    with tracked_query(run_id, key, timeout) as handle:
+        def connect():
+            # Les lectures passent par un réplica disponible (ou le principal) en lecture seule
+            if not read:
+                return db._engine.begin()
+            router = _routers.get(db)
+            return read_connection(router.read_engine() if router is not None else db._engine)
+
+        def execute():
+            # Les gros résultats sont résumés localement pour garder un prompt de taille constante
+            df, truncated = fetch_result(db, query, int(os.getenv("MAX_FETCH_ROWS", DEFAULT_MAX_FETCH_ROWS)), handle, connect)
+            summary = summarize_result(df, truncated, int(os.getenv("PROFILE_ROW_THRESHOLD", DEFAULT_PROFILE_ROW_THRESHOLD)),
+                                       int(os.getenv("PROFILE_MAX_CHARS", DEFAULT_PROFILE_MAX_CHARS)))
+            # Le graphique est borné en nombre de points (agrégation SQL ou réduction locale)
+            chart = build_chart(
+                df, truncated, db, query,
+                int(os.getenv("CHART_MAX_POINTS", DEFAULT_CHART_MAX_POINTS)),
+                int(os.getenv("CHART_MAX_BARS", DEFAULT_CHART_MAX_BARS)),
+                handle, connect,
+            )
+            return summary, chart
+
+        # Une même lecture déjà en cours sur la même base est partagée au lieu d'être relancée.
+        # La clé comprend la poignée : après une annulation, un nouveau run ne rejoint pas l'exécution annulée.
+        result, chart = get_single_flight().do(key + (handle,), execute) if read else execute()
+    # La requête a fonctionné : elle devient un exemple pour les prochaines questions.
+    # Les écritures n'en font pas partie, pour ne pas les suggérer au LLM.
+    if read:
+        get_example_store().add(connection_key(db), question, query)
+    if chart is not None and on_chart is not None:
+        on_chart(chart)
+    return result
+
+
+def prepare_answer(user_query: str, db: SQLDatabase, chat_history: list, llm_type: str, api_key: str,
+                   model: str = None, user: str = "anonymous", on_wait=None, run_id=None, usage=None,
+                   on_chart=None) -> dict:
+    # Génère et exécute la requête SQL, et retourne les variables du prompt de réponse.
+    # run_id identifie ce tour de conversation pour query_control.cancel_run.
+    check_cancelled(run_id)
+    config = {"callbacks": [usage]} if usage is not None else {}
+    sql_chain = get_llm_chain(db, llm_type, api_key, model, user, on_wait, check=cancel_check(run_id))
+    inputs = {"question": user_query, "chat_history": chat_history}
+    history = [(type(m).__name__, m.content) for m in prior_history(chat_history, user_query)]
+    # Partagé entre utilisateurs (une session en attente n'occupe pas de place dans la file du LLM),
+    # mais seulement avec la même clé d'API : la génération est facturée (et validée) sur cette clé
+    api_key_hash = hashlib.sha256((api_key or "").encode()).hexdigest()
+    key = ("sql", connection_key(db), llm_type, model, api_key_hash, normalize_question(user_query), hash(tuple(history)))
+    inputs["query"] = get_single_flight().do(key, lambda: sql_chain.invoke(inputs, config))
+    inputs["schema"] = get_table_info(db)
+    inputs["chat_history"] = prior_history(chat_history, user_query)
+    inputs["response"] = run_query(db, user_query, inputs["query"], run_id, on_chart)
+    return inputs
+
+
+def cancel_check(run_id):
+    # Vérifié par le planificateur à chaque réveil : un run annulé quitte la file d'attente du LLM
+    if run_id is None:
+        return None
+    return lambda: check_cancelled(run_id)
+
+
+def error_message(e: Exception) -> str:
+    if isinstance(e, (QueryCancelled, QueryTimeout, WriteRefused)):
+        return str(e)
+    if isinstance(e, sqlalchemy.exc.ProgrammingError):
+        return f"SQL error: {str(e)}"
+    return f"An unexpected error occurred: {str(e)}"
+
+
+def get_response(user_query: str, db: SQLDatabase, chat_history: list, llm_type: str, api_key: str, model: str = None,
+                 user: str = "anonymous", on_wait=None, run_id=None, usage=None, on_chart=None):
+    # usage (llm_usage.TokenUsage) reçoit les tokens consommés, dont ceux servis par le cache du fournisseur ;
+    # on_chart reçoit le graphique du résultat de la requête
+    try:
+        llm = create_llm(llm_type, api_key)
+    except Exception:
+        return "Failed to initialize LLM chain. Check your LLM settings."
+
+    try:
+        inputs = prepare_answer(user_query, db, chat_history, llm_type, api_key, model, user, on_wait, run_id, usage, on_chart)
+        check_cancelled(run_id)
+        llm = get_scheduler().wrap(llm, user, on_wait, cancel_check(run_id))
+        chain = answer_prompt() | llm | StrOutputParser()
+        return chain.invoke(inputs, {"callbacks": [usage]} if usage is not None else {})
+    except Exception as e:
+        return error_message(e)
+
+
+def stream_response(user_query: str, db: SQLDatabase, chat_history: list, llm_type: str, api_key: str,
+                    model: str = None, user: str = "anonymous", on_wait=None, run_id=None, usage=None,
+                    on_chart=None):
+    # Même pipeline que get_response, mais la réponse est produite morceau par morceau
+    try:
+        llm = create_llm(llm_type, api_key)
+    except Exception:
+        yield "Failed to initialize LLM chain. Check your LLM settings."
+        return
+
+    try:
+        inputs = prepare_answer(user_query, db, chat_history, llm_type, api_key, model, user, on_wait, run_id, usage, on_chart)
+        check_cancelled(run_id)
+        prompt_value = answer_prompt().invoke(inputs)
+        tokens = estimate_tokens(prompt_value.to_string())
+        answer_usage = TokenUsage()
+        yield from get_scheduler().stream(user, lambda: _stream_answer(llm, prompt_value, answer_usage), tokens, on_wait,
+                                          lambda text: answer_usage.prompt_tokens + answer_usage.completion_tokens,
+                                          cancel_check(run_id))
+        if usage is not None and answer_usage.calls:
+            usage.add(answer_usage.prompt_tokens, answer_usage.cached_tokens, answer_usage.completion_tokens)
+    except Exception as e:
+        yield error_message(e)
+
+
+def _stream_answer(llm, prompt_value, usage: TokenUsage):
+    # Texte de la réponse morceau par morceau ; usage reçoit les tokens rapportés par le fournisseur
+    # quand le flux les contient, sinon le planificateur garde son estimation
+    request = _openai_stream_request(llm, prompt_value)
+    if request is None:
+        for chunk in llm.stream(prompt_value, with_callback({}, usage)):
+            yield chunk.content
+        return
+    # L'usage n'arrive que dans un dernier morceau sans choix, que langchain-openai ignore :
+    # le flux est lu directement avec le client OpenAI (sans les callbacks LangChain)
+    for chunk in llm.client.create(**request):
+        if chunk.usage is not None:
+            usage.record(chunk.usage.model_dump())
+        if chunk.choices and chunk.choices[0].delta.content:
+            yield chunk.choices[0].delta.content
+
+
+def _openai_stream_request(llm, prompt_value):
+    # Paramètres de l'appel OpenAI avec l'usage dans le flux, ou None si la version installée de
+    # langchain-openai n'expose plus ces détails internes : la réponse passe alors par llm.stream
+    if not isinstance(llm, ChatOpenAI) or not callable(getattr(getattr(llm, "client", None), "create", None)):
+        return None
+    try:
+        messages, params = llm._create_message_dicts(prompt_value.to_messages(), None)
+    except (AttributeError, TypeError, ValueError):
+        return None
+    return {**params, "messages": messages, "stream": True, "stream_options": {"include_usage": True}}
@@ -0,0 +1,197 @@
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+
+
+# Annulation des requêtes en cours et délai maximal par requête.
+# Chaque exécution (un tour de conversation dans un run Streamlit, ou une requête du
+# backend) porte un identifiant de run et enregistre la requête qu'elle attend ; un
+# rerun, le bouton Stop ou une nouvelle question annulent le run au niveau du driver.
+# Un run annulé avant d'avoir lancé sa requête (génération SQL, file d'attente du LLM)
+# est marqué et ne la lancera pas. Une requête partagée par plusieurs runs
+# (single-flight) n'est annulée que lorsque plus aucun run ne l'attend.
+
+DEFAULT_QUERY_TIMEOUT = 60
+MAX_CANCELLED_RUNS = 10000
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class QueryTimeout(Exception):
+    pass
+
+
+# Messages des drivers lorsqu'une requête dépasse son délai maximal
+_TIMEOUT_MARKERS = (
+    "maximum statement execution time exceeded",  # MySQL (erreur 3024)
+    "canceling statement due to statement timeout",  # PostgreSQL
+    "query timeout expired",  # SQL Server (HYT00)
+    "interrupted",  # SQLite (gestionnaire de progression)
+)
+
+
+def _is_timeout(error: Exception) -> bool:
+    message = str(error).lower()
+    return any(marker in message for marker in _TIMEOUT_MARKERS)
+
+
+class QueryHandle:
+    def __init__(self, timeout: float = None):
+        self.timeout = timeout
+        self.runs = set()
+        self.cancelled = False
+        self._lock = threading.Lock()
+        self._current = None  # (connexion SQLAlchemy, id côté serveur, curseurs)
+
+    @contextmanager
+    def running(self, connection):
+        # Applique le délai maximal et rend la requête annulable le temps de son exécution
+        dialect = connection.dialect.name
+        dbapi_connection = connection.connection.dbapi_connection
+        backend_id = None
+        if dialect == "mysql":
+            backend_id = connection.execute(text("SELECT CONNECTION_ID()")).scalar()
+        _set_timeout(connection, dialect, dbapi_connection, self.timeout)
+
+        cursors = []
+
+        def capture_cursor(conn, cursor, statement, parameters, context, executemany):
+            cursors.append(cursor)
+
+        event.listen(connection, "before_cursor_execute", capture_cursor)
+        try:
+            with self._lock:
+                if self.cancelled:
+                    raise QueryCancelled("The query was cancelled.")
+                self._current = (connection, backend_id, cursors)
+            yield
+        except Exception as e:
+            if self.cancelled:
+                raise QueryCancelled("The query was cancelled.") from e
+            if self.timeout and _is_timeout(e):
+                raise QueryTimeout(
+                    f"The query took longer than QUERY_TIMEOUT ({self.timeout:g} s) and was stopped."
+                ) from e
+            raise
+        finally:
+            with self._lock:
+                self._current = None
+            event.remove(connection, "before_cursor_execute", capture_cursor)
+            _reset_timeout(connection, dialect, dbapi_connection, self.timeout)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            current = self._current
+        if current is None:
+            return
+        connection, backend_id, cursors = current
+        dialect = connection.dialect.name
+        dbapi_connection = connection.connection.dbapi_connection
+        if dialect == "mysql":
+            # KILL QUERY doit être envoyé depuis une autre connexion
+            with connection.engine.connect() as killer:
+                killer.execute(text(f"KILL QUERY {int(backend_id)}"))
+        elif dialect == "postgresql":
+            # psycopg2 envoie une demande d'annulation équivalente à pg_cancel_backend
+            dbapi_connection.cancel()
+        elif dialect == "mssql":
+            for cursor in cursors:
+                cursor.cancel()
+        elif dialect == "sqlite":
+            dbapi_connection.interrupt()
+
+
+def _set_timeout(connection, dialect, dbapi_connection, timeout):
+    if not timeout:
+        return
+    if dialect == "mysql":
+        # Remis à zéro par _reset_timeout. Ne s'applique qu'aux SELECT, ce qui correspond aux requêtes générées
+        connection.execute(text(f"SET SESSION MAX_EXECUTION_TIME = {int(timeout * 1000)}"))
+    elif dialect == "postgresql":
+        # Limité à la transaction ouverte par fetch_result
+        connection.execute(text(f"SET LOCAL statement_timeout = {int(timeout * 1000)}"))
+    elif dialect == "mssql":
+        dbapi_connection.timeout = max(1, int(timeout))
+    elif dialect == "sqlite":
+        deadline = time.monotonic() + timeout
+        dbapi_connection.set_progress_handler(lambda: int(time.monotonic() > deadline), 10000)
+
+
+def _reset_timeout(connection, dialect, dbapi_connection, timeout):
+    # La connexion retourne dans le pool : on ne laisse pas le délai derrière nous
+    if not timeout:
+        return
+    if dialect == "mysql":
+        try:
+            connection.execute(text("SET SESSION MAX_EXECUTION_TIME = 0"))
+        except Exception:
+            # Connexion inutilisable (requête tuée...) : elle est fermée au lieu de retourner au pool
+            connection.invalidate()
+    elif dialect == "mssql":
+        dbapi_connection.timeout = 0
+    elif dialect == "sqlite":
+        dbapi_connection.set_progress_handler(None, 0)
+
+
+_lock = threading.Lock()
+_handles = {}                   # clé de requête -> QueryHandle
+_runs = {}                      # run -> QueryHandle attendue
+_cancelled_runs = OrderedDict()  # runs annulés, les plus anciens oubliés au-delà de MAX_CANCELLED_RUNS
+
+
+def _raise_if_cancelled(run_id):
+    if run_id is not None and run_id in _cancelled_runs:
+        raise QueryCancelled("The query was cancelled.")
+
+
+def check_cancelled(run_id):
+    # Lève QueryCancelled si le run a été annulé (à appeler avant un travail coûteux)
+    with _lock:
+        _raise_if_cancelled(run_id)
+
+
+@contextmanager
+def tracked_query(run_id, key, timeout: float = None):
+    # Rattache le run à la requête identifiée par key (partagée si elle est déjà en cours)
+    member = run_id if run_id is not None else object()
+    with _lock:
+        _raise_if_cancelled(run_id)
+        handle = _handles.get(key)
+        if handle is None or handle.cancelled:
+            handle = _handles[key] = QueryHandle(timeout)
+        handle.runs.add(member)
+        if run_id is not None:
+            _runs[run_id] = handle
+    try:
+        yield handle
+    finally:
+        with _lock:
+            handle.runs.discard(member)
+            if run_id is not None and _runs.get(run_id) is handle:
+                del _runs[run_id]
+            if not handle.runs and _handles.get(key) is handle:
+                del _handles[key]
+
+
+def cancel_run(run_id) -> bool:
+    # Annule le run : sa requête en cours (sauf si d'autres runs l'attendent aussi) et celles
+    # qu'il lancerait ensuite. Retourne True si une requête était en cours.
+    with _lock:
+        _cancelled_runs[run_id] = True
+        _cancelled_runs.move_to_end(run_id)
+        while len(_cancelled_runs) > MAX_CANCELLED_RUNS:
+            _cancelled_runs.popitem(last=False)
+        handle = _runs.pop(run_id, None)
+        if handle is None:
+            return False
+        handle.runs.discard(run_id)
+        orphan = not handle.runs
+    if orphan:
+        handle.cancel()
+    return True
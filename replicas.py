@@ -0,0 +1,172 @@
+import itertools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from sqlalchemy import event, text
+
+
+# Routage des lectures vers les réplicas : les SELECT générés par le LLM sont envoyés
+# sur un réplica en bonne santé et suffisamment à jour, dans une transaction en
+# lecture seule avec un niveau d'isolation peu coûteux. Sans réplica disponible,
+# ils retombent sur le serveur principal avec les mêmes précautions.
+# La lecture seule est imposée par la base sur PostgreSQL, MySQL et SQLite ; SQL Server
+# n'a pas de mode équivalent par session, chaque instruction y est donc vérifiée.
+
+DEFAULT_MAX_LAG = 30
+DEFAULT_CHECK_INTERVAL = 10
+
+# Niveaux d'isolation par défaut des lectures (READ_ISOLATION_LEVEL les remplace,
+# par exemple SNAPSHOT sur SQL Server si ALLOW_SNAPSHOT_ISOLATION est activé).
+# MySQL garde le niveau du serveur : une transaction en lecture seule y lit déjà un
+# instantané cohérent sans poser de verrous.
+DEFAULT_READ_ISOLATION = {
+    "mssql": "READ UNCOMMITTED",
+    "mysql": None,
+    "postgresql": "READ COMMITTED",
+    "sqlite": "READ UNCOMMITTED",
+}
+
+_READ_QUERY_RE = re.compile(r"^\s*(\(\s*)*(select|with)\b", re.IGNORECASE)
+_WRITE_KEYWORD_RE = re.compile(r"\b(insert|update|delete|merge|into|create|alter|drop|truncate|grant|exec)\b", re.IGNORECASE)
+
+
+class WriteRefused(Exception):
+    pass
+
+
+def is_read_query(query: str) -> bool:
+    # Classée d'après l'instruction de tête : une valeur 'update' ou une colonne Create ne
+    # renvoie pas la lecture sur le principal. La lecture seule est ensuite imposée par la base
+    # (WITH ... DELETE, SELECT ... INTO sont refusés), ou par _refuse_writes sur SQL Server.
+    return bool(_READ_QUERY_RE.match(query))
+
+
+def parse_replicas(replicas: str, default_port: str) -> list:
+    # "host1, host2:3307" -> [("host1", port par défaut), ("host2", "3307")]
+    hosts = []
+    for item in replicas.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        host, _, port = item.rpartition(":")
+        if host and port.isdigit():
+            hosts.append((host, port))
+        else:
+            hosts.append((item, default_port))
+    return hosts
+
+
+def replica_lag(connection) -> float:
+    # Retard de réplication en secondes, None si la réplication est arrêtée
+    dialect = connection.dialect.name
+    if dialect == "mysql":
+        try:
+            row = connection.execute(text("SHOW REPLICA STATUS")).mappings().first()
+        except Exception:
+            row = connection.execute(text("SHOW SLAVE STATUS")).mappings().first()
+        if row is None:
+            return 0.0  # pas configuré comme réplica : considéré à jour
+        lag = row.get("Seconds_Behind_Source", row.get("Seconds_Behind_Master"))
+        return None if lag is None else float(lag)
+    elif dialect == "postgresql":
+        return float(connection.execute(text(
+            "SELECT CASE WHEN pg_is_in_recovery() "
+            "THEN COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0) ELSE 0 END"
+        )).scalar())
+    elif dialect == "mssql":
+        lag = connection.execute(text(
+            "SELECT MAX(secondary_lag_seconds) FROM sys.dm_hadr_database_replica_states WHERE is_local = 1"
+        )).scalar()
+        return float(lag or 0)
+    connection.execute(text("SELECT 1"))
+    return 0.0
+
+
+class ReplicaRouter:
+    def __init__(self, primary_engine, replica_engines: list,
+                 max_lag: float = DEFAULT_MAX_LAG, check_interval: float = DEFAULT_CHECK_INTERVAL):
+        self.primary_engine = primary_engine
+        self.replica_engines = replica_engines
+        self.max_lag = max_lag
+        self.check_interval = check_interval
+        self._lock = threading.Lock()
+        self._status = {}  # moteur -> (instant du contrôle, disponible ?)
+        self._next = itertools.cycle(range(len(replica_engines))) if replica_engines else None
+
+    def _is_available(self, engine) -> bool:
+        now = time.monotonic()
+        with self._lock:
+            checked = self._status.get(engine)
+        if checked is not None and now - checked[0] < self.check_interval:
+            return checked[1]
+        try:
+            with engine.connect() as connection:
+                lag = replica_lag(connection)
+            available = lag is not None and lag <= self.max_lag
+        except Exception:
+            available = False
+        with self._lock:
+            self._status[engine] = (now, available)
+        return available
+
+    def read_engine(self):
+        # Répartition tournante entre les réplicas disponibles, sinon le principal
+        for _ in range(len(self.replica_engines)):
+            with self._lock:
+                engine = self.replica_engines[next(self._next)]
+            if self._is_available(engine):
+                return engine
+        return self.primary_engine
+
+
+def read_isolation_level(dialect: str):
+    level = os.getenv("READ_ISOLATION_LEVEL")
+    if level is not None:
+        return level.strip().upper() or None
+    return DEFAULT_READ_ISOLATION.get(dialect)
+
+
+def _refuse_writes(connection, cursor, statement, parameters, context, executemany):
+    # SQL Server ne vérifie rien lui-même : tout mot-clé d'écriture est refusé, même dans une chaîne
+    if not is_read_query(statement) or _WRITE_KEYWORD_RE.search(statement):
+        raise WriteRefused("Only read queries can run on a read connection.")
+
+
+@contextmanager
+def read_connection(engine):
+    # Transaction en lecture seule, avec le niveau d'isolation des lectures.
+    # Elle est toujours annulée à la fin : une lecture n'a rien à valider.
+    connection = engine.connect()
+    try:
+        dialect = connection.dialect.name
+        options = {}
+        level = read_isolation_level(dialect)
+        if level:
+            options["isolation_level"] = level
+        if dialect == "postgresql":
+            options["postgresql_readonly"] = True
+        if options:
+            connection = connection.execution_options(**options)
+        if dialect == "mssql":
+            event.listen(connection, "before_cursor_execute", _refuse_writes)
+        transaction = connection.begin()
+        try:
+            if dialect == "mysql":
+                # S'applique à la transaction implicite ouverte par la requête suivante
+                connection.execute(text("SET TRANSACTION READ ONLY"))
+            elif dialect == "sqlite":
+                connection.execute(text("PRAGMA query_only = ON"))
+            yield connection
+        finally:
+            transaction.rollback()
+            if dialect == "sqlite":
+                # Le mode reste sur la connexion du pool : il est retiré avant de la rendre
+                try:
+                    connection.execute(text("PRAGMA query_only = OFF"))
+                except Exception:
+                    connection.invalidate()
+    finally:
+        connection.close()
@@ -0,0 +1,170 @@
+import datetime
+import decimal
+import numbers
+from contextlib import nullcontext
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import text
+
+
+# Au-delà de PROFILE_ROW_THRESHOLD lignes, ou de PROFILE_MAX_CHARS caractères une fois
+# formaté, le résultat n'est plus envoyé tel quel au LLM : on calcule localement un
+# profil statistique de taille constante.
+
+DEFAULT_PROFILE_ROW_THRESHOLD = 200
+DEFAULT_PROFILE_MAX_CHARS = 20000
+MAX_VALUE_LENGTH = 300  # comme SQLDatabase.run
+DEFAULT_MAX_FETCH_ROWS = 200000
+TOP_K = 5
+HISTOGRAM_BINS = 8
+TREND_BUCKETS = 6
+
+
+def fetch_result(db, query: str, max_rows: int = DEFAULT_MAX_FETCH_ROWS, handle=None, connect=None):
+    # Retourne (DataFrame, tronqué ?) en lisant au plus max_rows lignes.
+    # handle (query_control.QueryHandle) rend la requête annulable et applique son délai maximal ;
+    # connect ouvre la transaction à utiliser (réplica en lecture seule...), sinon celle du principal.
+    with connect() if connect is not None else db._engine.begin() as connection:
+        with handle.running(connection) if handle is not None else nullcontext():
+            cursor = connection.execute(text(query))
+            if not cursor.returns_rows:
+                return pd.DataFrame(), False
+            columns = list(cursor.keys())
+            rows = cursor.fetchmany(max_rows + 1)
+    truncated = len(rows) > max_rows
+    # Colonnes construites en objets : des entiers avec des NULL ne deviennent pas des flottants
+    df = pd.DataFrame([tuple(row) for row in rows[:max_rows]], columns=columns, dtype=object)
+    return coerce_types(df).infer_objects(), truncated
+
+
+def coerce_types(df: pd.DataFrame) -> pd.DataFrame:
+    # Les drivers renvoient DECIMAL et DATE comme des objets Python, et SQLite les dates
+    # sous forme de texte : on les vectorise
+    for column in df.columns:
+        series = df[column]
+        if series.dtype != object and not pd.api.types.is_string_dtype(series):
+            continue
+        sample = series.dropna()
+        if sample.empty:
+            continue
+        first = sample.iloc[0]
+        if isinstance(first, (decimal.Decimal, numbers.Number)) and not isinstance(first, bool):
+            values = pd.to_numeric(series, errors="coerce")
+            # Entiers avec des NULL : type entier nullable plutôt que flottant
+            if len(sample) < len(series) and all(isinstance(v, numbers.Integral) for v in sample):
+                values = values.astype("Int64")
+            df[column] = values
+        elif isinstance(first, (datetime.date, datetime.datetime)):
+            df[column] = pd.to_datetime(series, errors="coerce")
+        elif isinstance(first, str) and _looks_like_dates(sample.head(100)):
+            parsed = pd.to_datetime(series, errors="coerce")
+            # Toute la colonne doit être lisible, sinon elle reste du texte
+            if parsed.notna().sum() == len(sample):
+                df[column] = parsed
+    return df
+
+
+def _looks_like_dates(sample: pd.Series) -> bool:
+    # "2024-01-31", "2024-01-31 12:00:00"...
+    return all(isinstance(v, str) and v[:4].isdigit() and v[4:5] == "-" for v in sample)
+
+
+def truncate_value(value, length: int = MAX_VALUE_LENGTH):
+    # Coupe un texte trop long au dernier mot entier, comme SQLDatabase.run
+    if not isinstance(value, str) or len(value) <= length:
+        return value
+    return value[:length - 3].rsplit(" ", 1)[0] + "..."
+
+
+def format_rows(df: pd.DataFrame) -> str:
+    # Même représentation que SQLDatabase.run pour les petits résultats : NULL en None,
+    # textes coupés à MAX_VALUE_LENGTH caractères
+    if df.empty:
+        return ""
+    columns = []
+    for i in range(len(df.columns)):
+        series = df.iloc[:, i]
+        missing = series.isna().to_numpy()
+        if pd.api.types.is_datetime64_any_dtype(series):
+            series = series.astype(str)
+        columns.append([None if m else truncate_value(v) for v, m in zip(series.astype(object), missing)])
+    return str(list(zip(*columns)))
+
+
+def _fmt(value) -> str:
+    if isinstance(value, (float, np.floating)):
+        return f"{value:.6g}"
+    return str(value)
+
+
+def _numeric_profile(values: np.ndarray) -> list:
+    q = np.percentile(values, [0, 25, 50, 75, 100])
+    lines = [
+        f"min={_fmt(q[0])}, p25={_fmt(q[1])}, median={_fmt(q[2])}, p75={_fmt(q[3])}, max={_fmt(q[4])}, "
+        f"mean={_fmt(values.mean())}, std={_fmt(values.std())}, sum={_fmt(values.sum())}"
+    ]
+    if q[0] != q[4]:
+        counts, edges = np.histogram(values, bins=HISTOGRAM_BINS)
+        bins = ", ".join(f"[{_fmt(edges[i])}, {_fmt(edges[i + 1])}): {counts[i]}" for i in range(len(counts)))
+        lines.append(f"histogram: {bins}")
+    return lines
+
+
+def _top_values(series: pd.Series) -> str:
+    counts = series.value_counts(dropna=True)
+    top = ", ".join(f"{truncate_value(str(value))} ({count})" for value, count in counts.head(TOP_K).items())
+    return f"distinct={len(counts)}, top {min(TOP_K, len(counts))}: {top}"
+
+
+def _trend(df: pd.DataFrame, time_column: str, numeric_columns: list) -> list:
+    frame = df[[time_column] + numeric_columns].dropna(subset=[time_column]).sort_values(time_column)
+    if len(frame) < 2 or frame[time_column].iloc[0] == frame[time_column].iloc[-1]:
+        return []
+    # Moyennes par tranche de temps de même durée, et pente de la régression linéaire par jour
+    buckets = pd.cut(frame[time_column], bins=TREND_BUCKETS)
+    grouped = frame.groupby(buckets, observed=True)[numeric_columns].mean()
+    days = (frame[time_column] - frame[time_column].iloc[0]).dt.total_seconds().to_numpy() / 86400
+    lines = [f"Trend over `{time_column}` ({TREND_BUCKETS} equal time buckets, mean per bucket):"]
+    for column in numeric_columns:
+        values = frame[column].to_numpy(dtype=float)
+        mask = ~np.isnan(values)
+        slope = np.polyfit(days[mask], values[mask], 1)[0] if mask.sum() > 1 and np.ptp(days[mask]) > 0 else 0.0
+        means = ", ".join(_fmt(v) for v in grouped[column].to_numpy())
+        lines.append(f"  `{column}`: {means} (linear slope {_fmt(slope)} per day)")
+    return lines
+
+
+def profile_result(df: pd.DataFrame, truncated: bool = False) -> str:
+    lines = [f"The query returned {len(df)}{'+' if truncated else ''} rows and {len(df.columns)} columns. "
+             "The rows are summarized below instead of listed."]
+    numeric_columns, time_columns = [], []
+    for column in df.columns:
+        series = df[column]
+        nulls = int(series.isna().sum())
+        if pd.api.types.is_bool_dtype(series):
+            lines.append(f"Column `{column}` (boolean): nulls={nulls}, {_top_values(series)}")
+        elif pd.api.types.is_numeric_dtype(series):
+            numeric_columns.append(column)
+            values = series.dropna().to_numpy(dtype=float)
+            lines.append(f"Column `{column}` (numeric): nulls={nulls}")
+            if len(values):
+                lines.extend(f"  {line}" for line in _numeric_profile(values))
+        elif pd.api.types.is_datetime64_any_dtype(series):
+            time_columns.append(column)
+            lines.append(f"Column `{column}` (datetime): nulls={nulls}, min={series.min()}, max={series.max()}")
+        else:
+            lines.append(f"Column `{column}` (text): nulls={nulls}, {_top_values(series.astype(str).where(series.notna()))}")
+    if time_columns and numeric_columns:
+        lines.extend(_trend(df, time_columns[0], numeric_columns))
+    lines.append(f"First rows: {format_rows(df.head(TOP_K))}")
+    return "\n".join(lines)
+
+
+def summarize_result(df: pd.DataFrame, truncated: bool = False,
+                     threshold: int = DEFAULT_PROFILE_ROW_THRESHOLD, max_chars: int = DEFAULT_PROFILE_MAX_CHARS) -> str:
+    if len(df) <= threshold and not truncated:
+        rows = format_rows(df)
+        if len(rows) <= max_chars:
+            return rows
+    return profile_result(df, truncated)
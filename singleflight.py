@@ -0,0 +1,65 @@
+import threading
+
+
+# Déduplication des exécutions identiques en cours ("single-flight") : quand plusieurs
+# sessions demandent la même chose au même moment, une seule exécution a lieu et
+# toutes les sessions en attente reçoivent son résultat (ou son exception).
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.executed = 0
+        self.collapsed = 0
+
+    def do(self, key, fn):
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                if call is None:
+                    call = self._calls[key] = _Call()
+                    self.executed += 1
+                    break
+                self.collapsed += 1
+
+            call.done.wait()
+            if call.error is None:
+                return call.result
+            if isinstance(call.error, Exception):
+                raise call.error
+            # Le meneur a été interrompu (rerun Streamlit...) : on retente l'exécution
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            # Les requêtes arrivées après la fin relancent une nouvelle exécution
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "executed": self.executed,
+                "collapsed": self.collapsed,
+                "in_flight": len(self._calls),
+            }
+
+
+_single_flight = SingleFlight()
+
+
+def get_single_flight() -> SingleFlight:
+    return _single_flight
@@ -0,0 +1,26 @@
+import pandas as pd
+import pytest
+from langchain_community.utilities import SQLDatabase
+
+from auto_chart import _aggregate_in_database, _is_identifier
+
+
+@pytest.mark.parametrize("column", ["id", "ID", "customer_id", "Customer_ID", "ArtistId", "ArtistID"])
+def test_identifier_columns(column):
+    assert _is_identifier(pd.DataFrame({column: [1, 2]}), column)
+
+
+@pytest.mark.parametrize("column", ["paid", "valid", "void", "Amount_paid", "Paid", "Valid"])
+def test_words_ending_in_id_are_not_identifiers(column):
+    assert not _is_identifier(pd.DataFrame({column: [1, 2]}), column)
+
+
+@pytest.mark.parametrize("max_points", [10, 100])
+def test_database_aggregation_stays_within_max_points(tmp_path, max_points):
+    db = SQLDatabase.from_uri(f"sqlite:///{tmp_path / 'test.db'}")
+    # 3 jours et 7 secondes, commençant et finissant hors de l'alignement des intervalles
+    times = pd.date_range("2024-01-01 00:00:13", "2024-01-04 00:00:20", periods=5000)
+    pd.DataFrame({"ts": times.strftime("%Y-%m-%d %H:%M:%S"), "value": range(5000)}).to_sql(
+        "series", db._engine, index=False)
+    df = _aggregate_in_database(db, "SELECT ts, value FROM series", "ts", ["value"], max_points)
+    assert max_points - 2 <= len(df) <= max_points
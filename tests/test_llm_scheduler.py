@@ -0,0 +1,139 @@
+import threading
+import time
+
+from llm_scheduler import LLMScheduler, estimate_tokens
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def start(target):
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+def wait_until(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out"
+        time.sleep(0.01)
+
+
+def test_users_are_served_round_robin():
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    gate = threading.Event()
+    served = []
+    threads = [start(lambda: scheduler.run("a", gate.wait))]
+    wait_until(lambda: scheduler.stats()["active"] == 1)
+
+    for name, user in [("a1", "a"), ("a2", "a"), ("b1", "b")]:
+        threads.append(start(lambda name=name, user=user: scheduler.run(user, lambda: served.append(name))))
+        wait_until(lambda n=len(threads) - 1: scheduler.stats()["waiting"] == n)
+    gate.set()
+    for thread in threads:
+        thread.join(5)
+
+    assert served == ["a1", "b1", "a2"]
+
+
+def test_on_wait_is_called_outside_the_lock():
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    gate = threading.Event()
+    holder = start(lambda: scheduler.run("a", gate.wait))
+    wait_until(lambda: scheduler.stats()["active"] == 1)
+
+    positions, others_blocked = [], []
+
+    def on_wait(position):
+        positions.append(position)
+        # Une autre session doit pouvoir utiliser le planificateur pendant le callback
+        probe = start(scheduler.stats)
+        probe.join(1)
+        others_blocked.append(probe.is_alive())
+        gate.set()
+
+    scheduler.run("b", lambda: None, on_wait=on_wait)
+    holder.join(5)
+
+    assert positions == [1]
+    assert others_blocked == [False]
+
+
+def test_failed_callback_releases_the_queue():
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0)
+    gate = threading.Event()
+    holder = start(lambda: scheduler.run("a", gate.wait))
+    wait_until(lambda: scheduler.stats()["active"] == 1)
+
+    def on_wait(position):
+        raise KeyboardInterrupt
+
+    try:
+        scheduler.run("b", lambda: None, on_wait=on_wait)
+    except KeyboardInterrupt:
+        pass
+    gate.set()
+    holder.join(5)
+
+    assert scheduler.stats()["waiting"] == 0
+    assert scheduler.run("c", lambda: "ok") == "ok"
+
+
+def test_rate_limit_errors_are_retried():
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=0, max_retries=2, backoff_base=0)
+    calls = []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 3:
+            raise RateLimitError("rate limit")
+        return "ok"
+
+    assert scheduler.run("a", flaky) == "ok"
+    assert len(calls) == 3
+    assert scheduler.stats()["active"] == 0
+
+
+def test_token_budget_counts_reported_usage():
+    scheduler = LLMScheduler(max_concurrency=4, tokens_per_minute=1000)
+    scheduler.run("a", lambda: "answer", tokens=10, actual_tokens=lambda text: 600)
+    assert scheduler.stats()["tokens_last_minute"] == 600
+
+    # Sans usage rapporté, la réponse est estimée en plus du prompt
+    scheduler.run("a", lambda: "x" * 400, tokens=10)
+    assert scheduler.stats()["tokens_last_minute"] == 600 + 10 + estimate_tokens("x" * 400)
+
+
+def test_stream_counts_the_streamed_answer():
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=1000)
+    chunks = list(scheduler.stream("a", lambda: iter(["ab" * 20, "cd" * 20]), tokens=5))
+    assert len(chunks) == 2
+    assert scheduler.stats()["tokens_last_minute"] == 5 + estimate_tokens("ab" * 20 + "cd" * 20)
+    assert scheduler.stats()["active"] == 0
+
+
+def test_cancelled_call_leaves_the_queue_while_its_position_is_unchanged():
+    # Budget épuisé : la position du ticket ne change pas pendant l'attente
+    scheduler = LLMScheduler(max_concurrency=1, tokens_per_minute=10)
+    scheduler.run("a", lambda: None, tokens=10)
+    cancelled = threading.Event()
+    errors = []
+
+    def check():
+        if cancelled.is_set():
+            raise RuntimeError("cancelled")
+
+    def waiting():
+        try:
+            scheduler.run("b", lambda: None, tokens=5, on_wait=lambda position: None, check=check)
+        except RuntimeError as e:
+            errors.append(e)
+
+    thread = start(waiting)
+    wait_until(lambda: scheduler.stats()["waiting"] == 1)
+    cancelled.set()
+    thread.join(2)
+    assert not thread.is_alive() and errors
+    assert scheduler.stats()["waiting"] == 0
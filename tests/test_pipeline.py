@@ -0,0 +1,100 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pandas as pd
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy.engine import make_url
+
+import pipeline
+from example_store import ExampleStore
+from pipeline import build_database_uri, connection_key, init_database
+from query_control import QueryCancelled, cancel_run
+
+
+@pytest.mark.parametrize("db_type, port", [("SQL Server", "1433"), ("MySQL", "3306"), ("PostgreSQL", "5432")])
+def test_connection_key_has_no_password(db_type, port):
+    uri = build_database_uri(db_type, "analyst", "s3cret", "db.local", port, "sales")
+    key = connection_key(SimpleNamespace(_engine=SimpleNamespace(url=make_url(uri))))
+    assert "s3cret" not in key
+    assert "analyst@db.local" in key and key.endswith("/sales")
+
+
+def test_slow_database_does_not_block_other_sessions(tmp_path, monkeypatch):
+    slow_path, fast_path = str(tmp_path / "slow.db"), str(tmp_path / "fast.db")
+    opened, release = [], threading.Event()
+    from_uri = SQLDatabase.from_uri
+
+    def slow_from_uri(uri, **kwargs):
+        opened.append(uri)
+        if slow_path in uri:
+            # Hôte injoignable : la connexion attend son délai
+            release.wait(5)
+        return from_uri(uri, **kwargs)
+
+    monkeypatch.setattr(SQLDatabase, "from_uri", slow_from_uri)
+    slow = [threading.Thread(target=init_database, args=("SQLite", "", "", "", "", slow_path)) for _ in range(3)]
+    for thread in slow:
+        thread.start()
+    time.sleep(0.1)
+    start = time.monotonic()
+    init_database("SQLite", "", "", "", "", fast_path)
+    assert time.monotonic() - start < 1
+    release.set()
+    for thread in slow:
+        thread.join()
+    # Les sessions qui demandent la même base attendent une seule connexion
+    assert sum(slow_path in uri for uri in opened) == 1
+    assert pipeline._databases[(f"sqlite:///{slow_path}", ())] is init_database("SQLite", "", "", "", "", slow_path)
+
+
+def test_identical_writes_are_not_shared(tmp_path, monkeypatch):
+    db = init_database("SQLite", "", "", "", "", str(tmp_path / "writes.db"))
+    db.run("CREATE TABLE t (x INTEGER)")
+    monkeypatch.setattr(pipeline, "build_chart", lambda *args: None)
+    started = threading.Barrier(2)
+    execute = pipeline.fetch_result
+
+    def slow_fetch(*args):
+        # Les deux runs sont en cours en même temps
+        started.wait(5)
+        return execute(*args)
+
+    monkeypatch.setattr(pipeline, "fetch_result", slow_fetch)
+    runs = [threading.Thread(target=pipeline.run_query, args=(db, "add a row", "INSERT INTO t VALUES (1)"))
+            for _ in range(2)]
+    for thread in runs:
+        thread.start()
+    for thread in runs:
+        thread.join()
+    assert db.run("SELECT COUNT(*) FROM t") == "[(2,)]"
+
+
+def test_new_run_does_not_join_a_cancelled_query(tmp_path, monkeypatch):
+    db = init_database("SQLite", "", "", "", "", str(tmp_path / "cancel.db"))
+    store = ExampleStore(str(tmp_path / "examples.jsonl"))
+    monkeypatch.setattr(pipeline, "get_example_store", lambda: store)
+    monkeypatch.setattr(pipeline, "build_chart", lambda *args: None)
+    started = threading.Event()
+
+    def fetch(db, query, max_rows, handle, connect):
+        if not started.is_set():
+            started.set()
+            while not handle.cancelled:
+                time.sleep(0.01)
+            # La requête annulée met un moment à s'arrêter
+            time.sleep(0.3)
+            raise QueryCancelled("The query was cancelled.")
+        return pd.DataFrame({"x": [1]}), False
+
+    monkeypatch.setattr(pipeline, "fetch_result", fetch)
+    errors = []
+    first = threading.Thread(target=lambda: errors.append(
+        pytest.raises(QueryCancelled, pipeline.run_query, db, "one", "SELECT 1 AS x", "run-a")))
+    first.start()
+    started.wait(5)
+    cancel_run("run-a")
+    assert pipeline.run_query(db, "one", "SELECT 1 AS x", "run-b") == "[(1,)]"
+    first.join(5)
+    assert errors
@@ -0,0 +1,109 @@
+import threading
+import time
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from query_control import QueryCancelled, QueryTimeout, cancel_run, check_cancelled, tracked_query
+
+SLOW_QUERY = "WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 500000000) SELECT COUNT(*) FROM c"
+
+
+@pytest.fixture
+def engine(tmp_path):
+    return create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+
+
+def run_id():
+    return uuid.uuid4().hex
+
+
+def execute(engine, handle, query=SLOW_QUERY):
+    with engine.connect() as connection:
+        with handle.running(connection):
+            return connection.execute(text(query)).scalar()
+
+
+def test_cancelled_run_does_not_start_its_query(engine):
+    run = run_id()
+    # Annulé pendant la génération SQL : aucune requête n'est encore enregistrée
+    assert cancel_run(run) is False
+    with pytest.raises(QueryCancelled):
+        check_cancelled(run)
+    with pytest.raises(QueryCancelled):
+        with tracked_query(run, ("query", run), timeout=None):
+            pass
+
+
+def test_cancel_interrupts_running_query(engine):
+    run = run_id()
+    errors = []
+
+    def worker():
+        try:
+            with tracked_query(run, ("query", run), timeout=None) as handle:
+                execute(engine, handle)
+        except Exception as e:
+            errors.append(e)
+
+    thread = threading.Thread(target=worker)
+    thread.start()
+    time.sleep(0.3)
+    started = time.monotonic()
+    assert cancel_run(run) is True
+    thread.join(5)
+
+    assert time.monotonic() - started < 2
+    assert len(errors) == 1 and isinstance(errors[0], QueryCancelled)
+
+
+def test_shared_query_survives_until_last_run_cancels(engine):
+    first, second = run_id(), run_id()
+    key = ("query", first)
+    results = {}
+    entered = threading.Barrier(3)
+
+    def worker(run, leader):
+        try:
+            with tracked_query(run, key, timeout=None) as handle:
+                entered.wait(5)
+                if leader:
+                    results[run] = execute(engine, handle)
+                else:
+                    time.sleep(1)
+                    results[run] = "waited"
+        except Exception as e:
+            results[run] = e
+
+    threads = [threading.Thread(target=worker, args=(first, True)), threading.Thread(target=worker, args=(second, False))]
+    for thread in threads:
+        thread.start()
+    entered.wait(5)
+    time.sleep(0.3)
+    cancel_run(second)
+    time.sleep(0.3)
+    assert first not in results  # toujours attendue par le premier run
+    cancel_run(first)
+    for thread in threads:
+        thread.join(5)
+
+    assert isinstance(results[first], QueryCancelled)
+
+
+def test_timeout_is_reported_as_query_timeout(engine):
+    run = run_id()
+    with pytest.raises(QueryTimeout, match="QUERY_TIMEOUT"):
+        with tracked_query(run, ("query", run), timeout=0.3) as handle:
+            execute(engine, handle)
+
+
+def test_timeout_does_not_stay_on_pooled_connection(engine):
+    run = run_id()
+    with tracked_query(run, ("query", run), timeout=0.3) as handle:
+        assert execute(engine, handle, "SELECT 1") == 1
+    # Même connexion du pool, sans délai : la requête lente n'est pas interrompue
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM (WITH RECURSIVE c(x) AS "
+                                       "(SELECT 1 UNION ALL SELECT x + 1 FROM c WHERE x < 2000000) "
+                                       "SELECT x FROM c)")).scalar() == 2000000
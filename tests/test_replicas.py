@@ -0,0 +1,62 @@
+import pytest
+import sqlalchemy.exc
+from sqlalchemy import create_engine, event, text
+
+from replicas import WriteRefused, _refuse_writes, is_read_query, read_connection
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}")
+    with engine.begin() as connection:
+        connection.execute(text("CREATE TABLE t (x INTEGER)"))
+        connection.execute(text("INSERT INTO t VALUES (1)"))
+    return engine
+
+
+def test_sqlite_read_connection_refuses_writes(engine):
+    with pytest.raises(sqlalchemy.exc.OperationalError):
+        with read_connection(engine) as connection:
+            connection.execute(text("DELETE FROM t"))
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM t")).scalar() == 1
+
+
+def test_sqlite_read_only_mode_is_cleared_on_pooled_connection(engine):
+    with read_connection(engine) as connection:
+        assert connection.execute(text("SELECT x FROM t")).scalar() == 1
+    # Même connexion du pool, de nouveau en écriture
+    with engine.begin() as connection:
+        assert connection.execute(text("PRAGMA query_only")).scalar() == 0
+        connection.execute(text("INSERT INTO t VALUES (2)"))
+
+
+def test_statement_check_refuses_writes(engine):
+    # Vérification appliquée aux lectures SQL Server, qui n'ont pas de mode lecture seule
+    with engine.connect() as connection:
+        event.listen(connection, "before_cursor_execute", _refuse_writes)
+        assert connection.execute(text("SELECT x FROM t")).scalar() == 1
+        with pytest.raises(WriteRefused):
+            connection.execute(text("UPDATE t SET x = 2"))
+
+
+@pytest.mark.parametrize("query", [
+    "SELECT * FROM log WHERE action = 'update'",
+    'SELECT "Update", "Create" FROM audit',
+    "WITH recent AS (SELECT * FROM log) SELECT COUNT(*) FROM recent",
+    "(SELECT 1)",
+])
+def test_reads_are_classified_by_their_leading_statement(query):
+    assert is_read_query(query)
+
+
+@pytest.mark.parametrize("query", ["UPDATE t SET x = 2", "DELETE FROM t", "INSERT INTO t VALUES (3)", "EXEC proc"])
+def test_writes_are_not_reads(query):
+    assert not is_read_query(query)
+
+
+def test_statement_check_refuses_write_keywords_anywhere(engine):
+    with engine.connect() as connection:
+        event.listen(connection, "before_cursor_execute", _refuse_writes)
+        with pytest.raises(WriteRefused):
+            connection.execute(text("SELECT x FROM t WHERE 'update' <> ''"))
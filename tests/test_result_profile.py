@@ -0,0 +1,47 @@
+import pandas as pd
+import pytest
+from langchain_community.utilities import SQLDatabase
+from sqlalchemy import text
+
+from result_profile import MAX_VALUE_LENGTH, fetch_result, format_rows, summarize_result
+
+
+@pytest.fixture
+def db(tmp_path):
+    db = SQLDatabase.from_uri(f"sqlite:///{tmp_path / 'test.db'}")
+    with db._engine.begin() as connection:
+        connection.execute(text("CREATE TABLE sale (id INTEGER, amount REAL, note TEXT, day TEXT)"))
+        connection.execute(text("INSERT INTO sale VALUES (1, 9.5, 'first', '2024-01-01'), "
+                                "(NULL, NULL, NULL, NULL), (3, 2.0, 'third', '2024-01-03')"))
+    return db
+
+
+def test_fetch_keeps_types_and_nulls(db):
+    df, truncated = fetch_result(db, "SELECT * FROM sale")
+    assert not truncated
+    assert str(df["id"].dtype) == "Int64"
+    assert pd.api.types.is_float_dtype(df["amount"])
+    assert pd.api.types.is_datetime64_any_dtype(df["day"])
+    # Comme SQLDatabase.run : NULL en None, entiers sans partie décimale
+    assert format_rows(df) == ("[(1, 9.5, 'first', '2024-01-01'), (None, None, None, None), "
+                               "(3, 2.0, 'third', '2024-01-03')]")
+
+
+def test_long_values_are_truncated():
+    rows = format_rows(pd.DataFrame({"note": ["word " * 200]}))
+    assert len(rows) < MAX_VALUE_LENGTH + 10
+    assert rows.endswith("...',)]")
+
+
+def test_large_formatted_results_are_profiled():
+    df = pd.DataFrame({"id": range(50), "note": ["a long note " * 20] * 50})
+    assert summarize_result(df, threshold=200, max_chars=100000).startswith("[(0, ")
+    assert summarize_result(df, threshold=200, max_chars=1000).startswith("The query returned 50 rows")
+
+
+def test_row_threshold_and_truncation_trigger_the_profile():
+    df = pd.DataFrame({"id": range(10), "value": [1.5] * 10})
+    assert summarize_result(df, threshold=5).startswith("The query returned 10 rows")
+    profile = summarize_result(df.head(3), truncated=True)
+    assert profile.startswith("The query returned 3+ rows")
+    assert "Column `value` (numeric)" in profile
@@ -0,0 +1,111 @@
+import threading
+import time
+
+import pytest
+
+from singleflight import SingleFlight
+
+
+def run_concurrently(flight, key, fn, count):
+    results, errors = [], []
+
+    def call():
+        try:
+            results.append(flight.do(key, fn))
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=call) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(5)
+    return results, errors
+
+
+def test_concurrent_calls_share_one_execution():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def slow():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "result"
+
+    leader = threading.Thread(target=lambda: flight.do("key", slow))
+    leader.start()
+    started.wait(5)
+    results = []
+    followers = threading.Thread(target=lambda: results.extend(run_concurrently(flight, "key", slow, 4)[0]))
+    followers.start()
+    while flight.stats()["collapsed"] < 4:
+        time.sleep(0.01)
+    release.set()
+    leader.join(5)
+    followers.join(5)
+
+    assert calls == [1]
+    assert results == ["result"] * 4
+    assert flight.stats() == {"executed": 1, "collapsed": 4, "in_flight": 0}
+
+
+def test_followers_receive_the_leader_exception():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing():
+        release.wait(5)
+        raise ValueError("boom")
+
+    threading.Timer(0.2, release.set).start()
+    results, errors = run_concurrently(flight, "key", failing, 3)
+
+    assert results == []
+    assert len(errors) == 3 and all(isinstance(e, ValueError) for e in errors)
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    assert flight.stats()["executed"] == 2
+
+
+def test_calls_after_completion_run_again():
+    flight = SingleFlight()
+    calls = []
+    flight.do("key", lambda: calls.append(1))
+    flight.do("key", lambda: calls.append(1))
+    assert len(calls) == 2
+
+
+def test_interrupted_leader_lets_a_follower_retry():
+    flight = SingleFlight()
+    started = threading.Event()
+    release = threading.Event()
+
+    def interrupted():
+        started.set()
+        release.wait(5)
+        raise KeyboardInterrupt  # rerun Streamlit dans le thread du meneur
+
+    def leader():
+        with pytest.raises(KeyboardInterrupt):
+            flight.do("key", interrupted)
+
+    leader_thread = threading.Thread(target=leader)
+    leader_thread.start()
+    started.wait(5)
+    results = []
+    follower = threading.Thread(target=lambda: results.append(flight.do("key", lambda: "retried")))
+    follower.start()
+    while flight.stats()["collapsed"] < 1:
+        time.sleep(0.01)
+    release.set()
+    leader_thread.join(5)
+    follower.join(5)
+
+    assert results == ["retried"]
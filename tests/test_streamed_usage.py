@@ -0,0 +1,44 @@
+import pytest
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_core.prompt_values import StringPromptValue
+from langchain_openai import ChatOpenAI
+
+from llm_usage import TokenUsage
+from load_test import start_fake_llm
+from pipeline import _openai_stream_request, _stream_answer
+
+
+@pytest.fixture
+def fake_llm():
+    server = start_fake_llm(0.0)
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+
+
+def test_openai_stream_reports_usage(fake_llm):
+    llm = ChatOpenAI(api_key="sk-test", base_url=fake_llm, max_retries=0)
+    usage = TokenUsage()
+    chunks = list(_stream_answer(llm, StringPromptValue(text="Summarize the results"), usage))
+    assert len(chunks) > 1
+    assert "".join(chunks) == "Here is the answer based on the query results."
+    # Le dernier morceau du flux (sans choix) porte l'usage
+    assert usage.calls == 1
+    assert usage.prompt_tokens > 0 and usage.completion_tokens > 0
+
+
+def test_openai_request_needs_the_internal_api(monkeypatch):
+    llm = ChatOpenAI(api_key="sk-test", max_retries=0)
+    prompt = StringPromptValue(text="Summarize the results")
+    assert _openai_stream_request(llm, prompt)["stream_options"] == {"include_usage": True}
+    # Signature changée par une autre version de langchain-openai : retour à llm.stream
+    monkeypatch.setattr(ChatOpenAI, "_create_message_dicts", lambda self, messages: None)
+    assert _openai_stream_request(llm, prompt) is None
+
+
+def test_other_providers_keep_streaming():
+    llm = FakeListChatModel(responses=["The answer."])
+    usage = TokenUsage()
+    chunks = list(_stream_answer(llm, StringPromptValue(text="Summarize the results"), usage))
+    assert len(chunks) > 1 and "".join(chunks) == "The answer."
+    # Pas d'usage dans le flux : le planificateur garde son estimation
+    assert usage.calls == 0